@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import datetime
+import numpy as np
+
+# columnar storage for the artists_albums dictionary
+# instead of a list of lists per artist, each field is one numpy array with an entry per album (strings are kept in tables, and the
+# arrays hold their ids). albums are stored artist by artist, each artist's albums in the order they were in the dictionary (after
+# field_preprocessing, that's by date), so the albums of artist i are the slice artist_start[i]:artist_start[i + 1] of every array
+
+# value of a critic or user score that is missing ('tbd' on metacritic)
+MISSING_SCORE = -1
+
+# positions of the scores in each album list, as passed to the analysis functions as which_score
+CRITIC_SCORE = 0
+USER_SCORE = 4
+
+# date ordinal of 1 January 1970, where datetime64 dates start
+EPOCH_ORDINAL = 719163
+
+# one album, as a compact record instead of a list (see preprocessing.albums_to_records)
+# scores are always ints (MISSING_SCORE for 'tbd'), the date is a date ordinal (the metacritic date string isn't kept), and the role
+# string is interned, so every album with the same role shares one string
+class Album:
+    __slots__ = ('critic_score', 'title', 'date', 'role', 'user_score')
+
+    def __init__(self, critic_score, title, date, role, user_score):
+        self.critic_score = critic_score
+        self.title = title
+        self.date = date
+        self.role = sys.intern(role)
+        self.user_score = user_score
+
+    # param: this_album - album list, after field_preprocessing
+    # returns: the Album for it
+    @classmethod
+    def from_list(cls, this_album):
+        return cls(this_album[0] if isinstance(this_album[0], int) else MISSING_SCORE, this_album[1], this_album[5].toordinal(),
+                   this_album[3], this_album[4] if isinstance(this_album[4], int) else MISSING_SCORE)
+
+    # param: which_score - CRITIC_SCORE or USER_SCORE
+    # returns: that score
+    def score(self, which_score):
+        if which_score == CRITIC_SCORE:
+            return self.critic_score
+        if which_score == USER_SCORE:
+            return self.user_score
+        raise ValueError("which_score must be CRITIC_SCORE (0) or USER_SCORE (4), not " + str(which_score))
+
+    # returns: the release date, as a datetime (same as field_preprocessing gives)
+    def datetime(self):
+        return datetime.datetime.fromordinal(self.date)
+
+    def __eq__(self, other):
+        if not isinstance(other, Album):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return 'Album(' + ', '.join(repr(getattr(self, field)) for field in self.__slots__) + ')'
+
+class AlbumTable:
+    # params: critic_score, user_score - int16 arrays of scores out of 100, MISSING_SCORE where missing
+    #         date - int32 array of release dates, as proleptic gregorian ordinals (datetime.toordinal)
+    #         artist_id - int32 array, index of each album's artist in artist_names
+    #         album_ordinal - int32 array, position of each album among its artist's albums (from 0)
+    #         role_id - int16 array, index of each album's role in roles
+    #         artist_names, album_names, roles - lists of strings
+    def __init__(self, critic_score, user_score, date, artist_id, album_ordinal, role_id, artist_names, album_names, roles):
+        self.critic_score = critic_score
+        self.user_score = user_score
+        self.date = date
+        self.artist_id = artist_id
+        self.album_ordinal = album_ordinal
+        self.role_id = role_id
+        self.artist_names = artist_names
+        self.album_names = album_names
+        self.roles = roles
+
+        # number of albums per artist, and where each artist's albums start
+        self.num_albums = np.bincount(artist_id, minlength = len(artist_names)).astype(np.int32)
+        self.artist_start = np.zeros(len(artist_names) + 1, dtype = np.int64)
+        np.cumsum(self.num_albums, out = self.artist_start[1:])
+
+    def __len__(self):
+        return len(self.artist_id)
+
+    def num_artists(self):
+        return len(self.artist_names)
+
+    # param: which_score - CRITIC_SCORE or USER_SCORE
+    # returns: that score column
+    def scores(self, which_score):
+        if which_score == CRITIC_SCORE:
+            return self.critic_score
+        if which_score == USER_SCORE:
+            return self.user_score
+        raise ValueError("which_score must be CRITIC_SCORE (0) or USER_SCORE (4), not " + str(which_score))
+
+    # returns: the number of albums of each album's artist, per album
+    def artist_num_albums(self):
+        return self.num_albums[self.artist_id]
+
+    # returns: the year of each artist's first album (-1 for artists without albums)
+    def debut_years(self):
+        has_albums = self.num_albums > 0
+        first_dates = np.asarray(self.date)[self.artist_start[:-1][has_albums]]
+        years = np.full(self.num_artists(), -1, dtype = np.int32)
+        years[has_albums] = (first_dates - EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[Y]').astype(np.int32) + 1970
+        return years
+
+    # same as preprocessing.artists_after, as a mask instead of a copy
+    # param: year - remove artists if they have an album during or before this year
+    # returns: boolean array, per album, true for the albums of the artists kept
+    def artists_after_mask(self, year):
+        return (self.debut_years() > year)[self.artist_id]
+
+    # build the table from an artists_albums dictionary that has been through field_preprocessing
+    # (so scores are ints or 'tbd', and each album has its date as a datetime at position 5), or whose albums are Album records
+    @classmethod
+    def from_artists_albums(cls, artists_albums):
+        return cls.from_pairs(artists_albums.items())
+
+    # same as from_artists_albums, from any iterable of (artist, albums) pairs, ie a generator, so the whole dictionary doesn't have to be in memory
+    @classmethod
+    def from_pairs(cls, pairs):
+        critic_score = []
+        user_score = []
+        date = []
+        artist_id = []
+        album_ordinal = []
+        role_id = []
+        artist_names = []
+        album_names = []
+        roles = []
+        role_ids = {}
+
+        for artist, albums in pairs:
+            this_artist_id = len(artist_names)
+            artist_names.append(artist)
+            count = 0
+            for this_album in albums:
+                if not isinstance(this_album, Album):
+                    this_album = Album.from_list(this_album)
+                critic_score.append(this_album.critic_score)
+                user_score.append(this_album.user_score)
+                date.append(this_album.date)
+                artist_id.append(this_artist_id)
+                album_ordinal.append(count)
+                album_names.append(this_album.title)
+                if this_album.role not in role_ids:
+                    role_ids[this_album.role] = len(roles)
+                    roles.append(this_album.role)
+                role_id.append(role_ids[this_album.role])
+                count += 1
+
+        return cls(np.array(critic_score, dtype = np.int16), np.array(user_score, dtype = np.int16),
+                   np.array(date, dtype = np.int32), np.array(artist_id, dtype = np.int32),
+                   np.array(album_ordinal, dtype = np.int32), np.array(role_id, dtype = np.int16),
+                   artist_names, album_names, roles)
+
+# param: artists_albums - an AlbumTable, or an artists_albums dictionary (after field_preprocessing)
+# returns: the AlbumTable for it
+def as_album_table(artists_albums):
+    if isinstance(artists_albums, AlbumTable):
+        return artists_albums
+    return AlbumTable.from_artists_albums(artists_albums)
+
+
+# on-disk form of an AlbumTable, so it doesn't have to be rebuilt from the .json files on every run
+# a directory with one .npy file per array (loaded memory-mapped, so opening it is nearly free), each string table as a string pool
+# (the utf-8 bytes of all of its strings in one .npy, and their offsets in another)
+# every save writes a new build directory inside the cache directory, and then replaces manifest.json (atomically), which names the
+# current build and holds the hash of the .json files it was built from. files of a build are never written again once it is published,
+# so a table that is already loaded (and memory-mapped) keeps its data when the cache is rebuilt
+# build directories are named after the time they were started, so publishing a build only removes the ones started before it (not one
+# another process is still writing), and a manifest naming a build that has been removed anyway just reads as no table
+
+TABLE_FORMAT_VERSION = 2
+TABLE_ARRAYS = ['critic_score', 'user_score', 'date', 'artist_id', 'album_ordinal', 'role_id']
+TABLE_STRINGS = ['artist_names', 'album_names', 'roles']
+
+# a read-only list of strings, stored as one utf-8 byte array and the offsets of each string in it
+# strings are only decoded when they are used
+class StringPool:
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("StringPool index out of range")
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # param: strings - list of strings
+    # returns: (data, offsets) arrays for the pool
+    @staticmethod
+    def encode(strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+        np.cumsum([len(e) for e in encoded], out = offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype = np.uint8), offsets
+
+# param: file_names - list of files
+# returns: sha256 (hex) of the files' contents, in order
+def files_hash(file_names):
+    h = hashlib.sha256()
+    for file_name in file_names:
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda : f.read(1024 * 1024), b''):
+                h.update(block)
+        h.update(b'\0')
+    return h.hexdigest()
+
+# params: table - the AlbumTable
+#         directory - where to save it (created if needed, a table already there is replaced)
+#         source_hash - hash of the files the table was built from (see files_hash)
+def save_album_table(table, directory, source_hash):
+    os.makedirs(directory, exist_ok = True)
+    build_dir = tempfile.mkdtemp(prefix = 'table-' + str(time.time_ns()).zfill(20) + '-', dir = directory)
+    build = os.path.basename(build_dir)
+
+    for name in TABLE_ARRAYS:
+        np.save(os.path.join(build_dir, name + '.npy'), np.asarray(getattr(table, name)))
+    for name in TABLE_STRINGS:
+        data, offsets = StringPool.encode(list(getattr(table, name)))
+        np.save(os.path.join(build_dir, name + '.pool.npy'), data)
+        np.save(os.path.join(build_dir, name + '.offsets.npy'), offsets)
+
+    manifest_file = os.path.join(directory, 'manifest.json')
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump({'version': TABLE_FORMAT_VERSION, 'source_hash': source_hash, 'build': build,
+                   'num_albums': len(table), 'num_artists': table.num_artists()}, f)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+    # builds started before this one are no longer used by new loads. tables already loaded from them keep their mappings on posix
+    # systems (where mapped files can be removed), elsewhere removing them fails and they are left for a later save
+    for name in os.listdir(directory):
+        if name.startswith('table-') and name < build:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors = True)
+
+# params: directory - where a table was saved with save_album_table
+#         source_hash - if given, the table is only loaded if it was built from files with this hash
+# returns: the AlbumTable, with memory-mapped (read-only) arrays and string pools, or None if there is no valid table in directory (including
+#          when the manifest names a build that has since been removed)
+def load_album_table(directory, source_hash = None):
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != TABLE_FORMAT_VERSION or (source_hash is not None and manifest.get('source_hash') != source_hash):
+        return None
+
+    build_dir = os.path.join(directory, manifest['build'])
+    try:
+        arrays = [np.load(os.path.join(build_dir, name + '.npy'), mmap_mode = 'r') for name in TABLE_ARRAYS]
+        strings = [StringPool(np.load(os.path.join(build_dir, name + '.pool.npy'), mmap_mode = 'r'),
+                              np.load(os.path.join(build_dir, name + '.offsets.npy'), mmap_mode = 'r')) for name in TABLE_STRINGS]
+    except FileNotFoundError:
+        return None
+    return AlbumTable(*arrays, *strings)
@@ -1,15 +1,17 @@
-import statistics as stats
 import decimal
 import math
 import numpy as np
 import matplotlib.pyplot as plt
 import copy
+from functools import lru_cache
 
 import thinkstats2 as ts2
 import thinkplot as tp
 import hypothesis as hyp
 import estimation as est
 
+import album_store as als
+
 # One-sided correlation test
 # building upon code from Downey's ThinkStats2
 class CorrelationOneSidedPermute(hyp.CorrelationPermute):
@@ -27,52 +29,83 @@ def PrintDiffMeansOneSided(data, title="CDF of sampling distribution of null hyp
     tp.Show(xlabel=label,ylabel='CDF', title=title)
     print("Calculated p-value:", pvalue)
 
+# bootstrap resampling
+# the resamples are drawn as an (iterations, sample size) matrix of indexes, a chunk of rows at a time so the indexes and resampled
+# values fit in memory_budget bytes, and each reducer is applied along the rows of a chunk at once
+
+BOOTSTRAP_MEMORY_BUDGET = 64 * 1024 * 1024
+# the statistics bootstrap computes if not given reducers
+BOOTSTRAP_REDUCERS = {'mean': np.mean, 'median': np.median}
+
+# params: data - the sample (array, list or pandas Series)
+#         iters - number of resamples
+#         reducers - dictionary of key = name, value = function of (array, axis), ie np.mean, computing a statistic of each resample
+#                    (BOOTSTRAP_REDUCERS if None)
+#         rng - np.random.Generator, or a seed for one (if None, seeded from np.random's global state, so np.random.seed
+#               still makes it reproducible)
+#         memory_budget - about how many bytes to use for each chunk of resamples
+# returns: dictionary of key = name, value = float array of the reducer's value for each resample
+def bootstrap(data, iters, reducers = None, rng = None, memory_budget = BOOTSTRAP_MEMORY_BUDGET):
+    values = np.asarray(data)
+    sample_size = len(values)
+    if reducers is None:
+        reducers = BOOTSTRAP_REDUCERS
+    if rng is None:
+        rng = np.random.randint(2**32, dtype = np.uint64)
+    rng = np.random.default_rng(rng)
+    chunk_size = max(1, memory_budget // (sample_size * (np.dtype(np.int64).itemsize + values.itemsize)))
+
+    results = {name: np.empty(iters) for name in reducers}
+    for start in range(0, iters, chunk_size):
+        stop = min(iters, start + chunk_size)
+        resamples = values[rng.integers(0, sample_size, size = (stop - start, sample_size))]
+        for name, reducer in reducers.items():
+            results[name][start:stop] = reducer(resamples, axis = 1)
+    return results
+
 # from Downey's ThinkStats2
 # for investigating estimator bias
-def estimate_mean_error(data, iters):
+# params: data - the sample
+#         iters - number of resamples (see bootstrap)
+#         rng - np.random.Generator, or a seed for one (see bootstrap)
+def estimate_mean_error(data, iters, rng = None):
     # assuming the actual population mean was the sample mean
     data_mean = data.mean()
-    sample_size = len(data)
 
-    means = []
-    medians = []
-    for _ in range(iters):
-        xs = np.random.choice(data.values, len(data), replace=True)
-        xbar = np.mean(xs)
-        median = np.median(xs)
-        means.append(xbar)
-        medians.append(median)
+    resampled = bootstrap(data, iters, rng = rng)
 
     print(iters, 'iterations')
-    print('Mean Error xbar', est.MeanError(means, data_mean))
-    print('Mean Error sample median', est.MeanError(medians, data_mean), '\n')
+    print('Mean Error xbar', est.MeanError(resampled['mean'], data_mean))
+    print('Mean Error sample median', est.MeanError(resampled['median'], data_mean), '\n')
 
 
 # Using sample mean & median as estimators
 # Get sampling distribution, CI, standard error
 # The code below is from Downey's ThinkStats2
-def estimate_mean(data):
+# params: data - the sample
+#         iters - number of resamples (see bootstrap)
+#         rng - np.random.Generator, or a seed for one (see bootstrap)
+# returns: (means, medians) arrays of the resamples
+def estimate_mean(data, iters = 1000, rng = None):
     # assuming the actual population mean was the sample mean
     data_mean = data.mean()
     sample_size = len(data)
     print("Sample size of first albums reviewed by users is", sample_size)
 
-    means = []
-    medians = []
-    for _ in range(1000):
-        xs = np.random.choice(data.values, len(data), replace=True)
-        xbar = np.mean(xs)
-        median = np.median(xs)
-        means.append(xbar)
-        medians.append(median)
+    resampled = bootstrap(data, iters, rng = rng)
+    means = resampled['mean']
+    medians = resampled['median']
 
     print('\nStandard Error xbar', "%.2f" % est.RMSE(means, data_mean))
     print('Standard Error median', "%.2f" % est.RMSE(medians, data_mean))
     return means, medians
 
 # from Downey's ThinkStats2
-def PlotSamplingDistribution(data):
-    means, medians = estimate_mean(data)
+# params: data - the sample
+#         iters - number of resamples (see bootstrap)
+#         rng - np.random.Generator, or a seed for one (see bootstrap)
+def PlotSamplingDistribution(data, iters = 1000, rng = None):
+    means, medians = estimate_mean(data, iters, rng)
     cdf = ts2.Cdf(means)
     ci = cdf.Percentile(5), cdf.Percentile(95)
     print("90% Confidence Interval:", "(", "%.2f" % ci[0], ",", "%.2f" % ci[1], ")")
@@ -239,40 +272,100 @@ def print_unique_artists_per_genre(rock_artists_albums, indie_artists_albums, al
     plt.title('Number of Artists Unique to a Given Genre')
     plt.show()
 
-# param: histo - the histogram to bin
+# binning album positions
+# an album's position is count / (num_albums - 1), count being its place (from 0) among its artist's albums, so from 0 for the first
+# album to 1 for the last. positions are rounded to 3 significant digits, and each bin is keyed by its upper edge, edges going up in
+# steps of 1 / num_bins, also rounded to 3 digits, all as decimal.Decimal with a precision of 3 (in a local context, not the global one).
+# a position goes in the first bin whose edge is >= it
+# every decimal of 3 digits converts to a different float, and in the same order, so the positions are binned as float arrays
+
+BIN_PRECISION = 3
+
+# param: num_albums - an artist's number of albums (at least 2)
+# returns: read-only float array of the positions of the artist's albums
+@lru_cache(maxsize = None)
+def album_positions(num_albums):
+    with decimal.localcontext() as ctx:
+        ctx.prec = BIN_PRECISION
+        adj_num_albums = decimal.Decimal(num_albums - 1)
+        positions = np.array([float(decimal.Decimal(count) / adj_num_albums) for count in range(num_albums)])
+    positions.setflags(write = False)
+    return positions
+
+# params: num_bins - # of equal-sized bins
+#         max_position - the largest position to bin
+# returns: tuple of the edges of the bins (decimal.Decimal), up to the first one >= max_position
+@lru_cache(maxsize = None)
+def bin_edges(num_bins, max_position = 1.0):
+    with decimal.localcontext() as ctx:
+        ctx.prec = BIN_PRECISION
+        bin_incr = decimal.Decimal('1') / decimal.Decimal(num_bins)
+        edges = [bin_incr]
+        while float(edges[-1]) < max_position:
+            edges.append(edges[-1] + bin_incr)
+    return tuple(edges)
+
+# param: table - an AlbumTable
+# returns: float array of the position of each album of the table (see album_positions), NaN for the albums of artists with only one
+def table_positions(table):
+    num_albums, inverse = np.unique(table.artist_num_albums(), return_inverse = True)
+    # all the positions for each number of albums, one after the other, and where each number's start
+    grid = np.concatenate([album_positions(int(n)) if n > 1 else np.full(n, np.nan) for n in num_albums] + [np.zeros(0)])
+    grid_start = np.cumsum(num_albums) - num_albums
+    return grid[grid_start[inverse.ravel()] + np.asarray(table.album_ordinal)]
+
+# params: positions - float array of positions
+#         num_bins - # of equal-sized bins
+# returns: (index of the bin of each position, the bins' edges)
+def bin_indexes(positions, num_bins = 5):
+    positions = np.asarray(positions, dtype = float)
+    edges = bin_edges(num_bins, float(positions.max()) if len(positions) > 0 else 0.0)
+    return np.searchsorted(np.array([float(edge) for edge in edges]), positions, side = 'left'), edges
+
+# params: positions - float array of positions
+#         values - array of a value for each position
+#         num_bins - # of equal-sized bins
+# returns: dictionary of key = bin edge (decimal.Decimal), value = array of the values in that bin, ordered by position (values at the
+#          same position in the order given). only bins with values in them are included, in order
+def binned_values(positions, values, num_bins = 5):
+    indexes, edges = bin_indexes(positions, num_bins)
+    order = np.argsort(np.asarray(positions, dtype = float), kind = 'stable')
+    bin_values = np.split(np.asarray(values)[order], np.cumsum(np.bincount(indexes, minlength = len(edges)))[:-1])
+    return {edge: these_values for edge, these_values in zip(edges, bin_values) if len(these_values) > 0}
+
+# same as binned_values, with the sum of each bin's values (added up in the same order) instead of the values
+def binned_sums(positions, values, num_bins = 5):
+    indexes, edges = bin_indexes(positions, num_bins)
+    order = np.argsort(np.asarray(positions, dtype = float), kind = 'stable')
+    counts = np.bincount(indexes, minlength = len(edges))
+    sums = np.bincount(indexes[order], weights = np.asarray(values, dtype = float)[order], minlength = len(edges))
+    return {edge: float(this_sum) for edge, this_sum, count in zip(edges, sums, counts) if count > 0}
+
+# param: histo - the histogram to bin (keys are positions, values are lists)
 #        num_bins - how many equal-sized (range) bins do you want?
-# returns: a copy of histogram binned into num_bins equal-size bins
+# returns: a copy of histogram binned into num_bins equal-size bins (see binned_values)
 def binned(histo, num_bins = 5):
-    decimal.getcontext().prec = 3
-
+    positions = []
+    values = []
+    for val, freq in histo.items():
+        positions.extend([float(val)] * len(freq))
+        values.extend(freq)
+    if len(positions) == 0:
+        return {}
+
+    order = np.argsort(np.array(positions), kind = 'stable')
+    indexes, edges = bin_indexes(positions, num_bins)
     histo_binned = {}
-
-    bin_incr = decimal.Decimal('1') / decimal.Decimal(num_bins)
-    #print("bin_incr: ", bin_incr)
-    #cur_bin = decimal.Decimal('0')
-    cur_bin = bin_incr
-
-    for val, freq in sorted(histo.items()):
-        #print("cur_bin: ", cur_bin)
-        #print("val: ", val)
-
-        while val > cur_bin:
-            cur_bin += bin_incr
-
-        if cur_bin not in histo_binned:
-            histo_binned[cur_bin] = []
-
-        histo_binned[cur_bin] += freq
-
-    #print(sorted(histo, key = lambda kv : kv[1]))
-    #print(sorted(histo_binned, key = lambda kv : kv[1]))
+    for i in order:
+        histo_binned.setdefault(edges[indexes[i]], []).append(values[i])
     return histo_binned
 
-# copied from Allen Downey's ThinkStats2... needed to implement slightly differently since list.mean() should be stats.mean(list), etc
+# copied from Allen Downey's ThinkStats2... implemented with np.mean / np.var (sample variance, ddof = 1) so it
+# works on lists or numpy arrays, not only on numpy arrays
 def cohens_effect_size(list1, list2):
-    diff = stats.mean(list1) - stats.mean(list2)
-    var1 = stats.variance(list1)
-    var2 = stats.variance(list2)
+    diff = np.mean(list1) - np.mean(list2)
+    var1 = np.var(list1, ddof = 1)
+    var2 = np.var(list2, ddof = 1)
 
     n1 = len(list1)
     n2 = len(list2)
@@ -282,28 +375,15 @@ def cohens_effect_size(list1, list2):
     return d
 
 # comparing users and critics scores (irrespective of album ID)
+# param: artists_albums - an AlbumTable, or the main dictionary (which is turned into one)
 def users_vs_critics(artists_albums):
-    users_scores = []
-    critics_scores = []
-
-    for artist, albums in artists_albums.items():
-        c_scores = [this_album[0] for this_album in albums if this_album[0] != 'tbd']
-        u_scores = [this_album[4] for this_album in albums if this_album[4] != 'tbd']
-
-        for score in c_scores:
-            try:
-                critics_scores.append(int(score))
-            except ValueError:
-                pass
+    table = als.as_album_table(artists_albums)
 
-        for score in u_scores:
-            try:
-                users_scores.append(int(score))
-            except ValueError:
-                pass
+    users_scores = table.user_score[table.user_score != als.MISSING_SCORE]
+    critics_scores = table.critic_score[table.critic_score != als.MISSING_SCORE]
 
-    avg_user_score = stats.mean(users_scores)
-    avg_critics_score = stats.mean(critics_scores)
+    avg_user_score = float(users_scores.mean())
+    avg_critics_score = float(critics_scores.mean())
 
     cohensD = cohens_effect_size(users_scores, critics_scores)
 
@@ -314,92 +394,114 @@ def users_vs_critics(artists_albums):
     return {"Users" : avg_user_score, "Critics" : avg_critics_score}
 
 
-# params: artists_albums - main dictionary (albums are already sorted per artist)
+# params: artists_albums - an AlbumTable, or the main dictionary (which is turned into one)
 #         which_scores - number indicating users or critics (position in album list)
 #         num_bins - # of equal-sized bins
-# returns: per each bin of album IDs, lists of scores for album IDs that fall into that bin
+# returns: per each bin of album IDs, array of scores for album IDs that fall into that bin (see binned_values)
+#          albums with a 'tbd' score are left out, and so are artists with only one album (who have no album IDs)
 def get_scores(artists_albums, which_score, num_bins = 5):
-    decimal.getcontext().prec = 3
-
-    albums_scores = {}
-
-    # dont remove all albums for artists that have 'tbd' scores
-
-    for artist, albums in artists_albums.items():
-
-        count = decimal.Decimal('0')
-        adj_num_albums = decimal.Decimal(len(albums) - 1)
-
-        for this_album in albums:
-            if this_album[which_score] != 'tbd':
-                try: # incase this_album[which_score] is another string, not 'tbd'
-                    int_score = int(this_album[which_score])
-                    this_index = count / adj_num_albums
-
-                    if this_index in albums_scores:
-                        albums_scores[this_index].append(int_score)
-                    else:
-                        albums_scores[this_index] = [int_score]
-                except ValueError:
-                    pass
-            count += 1
-
-    #return binned_avg(albums_scores, albums_scores_counts, num_bins)
-    # bin
-    albums_scores_binned = binned(albums_scores, num_bins)
-
-    return albums_scores_binned
+    table = als.as_album_table(artists_albums)
+    scores = np.asarray(table.scores(which_score))
+    positions = table_positions(table)
+
+    keep = (scores != als.MISSING_SCORE) & ~np.isnan(positions)
+    return binned_values(positions[keep], scores[keep].astype(np.int64), num_bins)
+
+
+# ranks of scores within groups (ie artists), all groups at once: 1 for the highest score of each group, and so on
+# params: groups - int array, the group of each score
+#         scores - array of scores
+#         ties - how scores tied within a group are ranked (as scipy.stats.rankdata's method, but from the highest score):
+#                'ordinal' - in the order they are given, 'min' / 'max' - all get the lowest / highest of their ranks,
+#                'average' - all get the mean of their ranks, 'dense' - all get the same rank, and the next score the rank after
+# returns: float array of the rank of each score
+def grouped_ranks(groups, scores, ties = 'ordinal'):
+    if ties not in ('ordinal', 'min', 'max', 'average', 'dense'):
+        raise ValueError("ties must be 'ordinal', 'min', 'max', 'average' or 'dense', not " + repr(ties))
+
+    # by group, then highest score first (lexsort is stable, so tied scores stay in the order given)
+    order = np.lexsort((-np.asarray(scores, dtype = np.float64), groups))
+    sorted_groups = np.asarray(groups)[order]
+    sorted_scores = np.asarray(scores)[order]
+
+    i = np.arange(len(order))
+    group_new = np.ones(len(order), dtype = bool)
+    group_new[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    group_start = np.maximum.accumulate(np.where(group_new, i, 0))
+
+    if ties == 'ordinal':
+        sorted_ranks = i - group_start + 1
+    else:
+        # runs of the same score within a group
+        run_new = group_new.copy()
+        run_new[1:] |= sorted_scores[1:] != sorted_scores[:-1]
+        run_id = np.cumsum(run_new) - 1
+        run_first = np.flatnonzero(run_new)
+        run_last = np.append(run_first[1:], len(order)) - 1
+
+        min_ranks = run_first[run_id] - group_start + 1
+        max_ranks = run_last[run_id] - group_start + 1
+        if ties == 'min':
+            sorted_ranks = min_ranks
+        elif ties == 'max':
+            sorted_ranks = max_ranks
+        elif ties == 'average':
+            sorted_ranks = (min_ranks + max_ranks) / 2
+        else:
+            sorted_ranks = run_id - run_id[group_start] + 1
 
+    ranks = np.empty(len(order))
+    ranks[order] = sorted_ranks
+    return ranks
 
-# params: artists_albums - main dictionary (albums are already sorted per artist)
+# params: artists_albums - an AlbumTable, or the main dictionary (which is turned into one)
 #         which_scores - number indicating users or critics (position in album list)
+#         chance_weighting - divide each rank by the artist's number of albums
 #         num_bins - # of equal-sized bins
-# returns: per each bin of album IDs, lists of ranks for album IDs that fall into that bin
-def get_ranks(artists_albums, which_score, chance_weighting = False, num_bins = 5):
-    decimal.getcontext().prec = 3
-
-    IDs_ranks = {}
-
-    for artist, albums in artists_albums.items():
-        ratings = [this_album[which_score] for this_album in albums]
-        if 'tbd' not in ratings:
-            ratings_dict = {}
-
-            int_count = 0
-            count = decimal.Decimal('0')
-            adj_num_albums = decimal.Decimal(len(albums) - 1)
-            for this_album in albums:
-                this_index = count / adj_num_albums
-                ratings_dict[this_index] = ratings[int_count]
-                count += 1
-                int_count += 1
-
-            #print(ratings)
-            #print(sorted(ratings_dict.items()))
-            num_albums = len(albums)
-            rank = 1.0
-            for albumID, score in sorted(ratings_dict.items(), key = lambda kv : kv[1], reverse=True):
-                if albumID in IDs_ranks:
-                    if chance_weighting:
-                        IDs_ranks[albumID].append(rank / num_albums)
-                    else:
-                        IDs_ranks[albumID].append(rank)
-                else:
-                    if chance_weighting:
-                        IDs_ranks[albumID] = [rank / num_albums]
-                    else:
-                        IDs_ranks[albumID] = [rank]
-                rank += 1
+#         ties - how albums with the same score are ranked (see grouped_ranks). 'ordinal' ranks them in album order
+# returns: per each bin of album IDs, array of ranks for album IDs that fall into that bin (see binned_values)
+#          only artists without 'tbd' scores are ranked, and not artists with only one album (who have no album IDs)
+def get_ranks(artists_albums, which_score, chance_weighting = False, num_bins = 5, ties = 'ordinal'):
+    table = als.as_album_table(artists_albums)
+    scores = np.asarray(table.scores(which_score))
+    artist_id = np.asarray(table.artist_id)
+
+    has_missing = np.bincount(artist_id[scores == als.MISSING_SCORE], minlength = table.num_artists()) > 0
+    keep = (~has_missing & (table.num_albums > 1))[artist_id]
+
+    ranks = grouped_ranks(artist_id[keep], scores[keep], ties)
+    if chance_weighting:
+        ranks /= table.artist_num_albums()[keep]
 
     # bin
-    IDs_ranks_binned = binned(IDs_ranks, num_bins)
-    #for binID, binVal in IDs_ranks_binned.items():
-    #    IDs_ranks_binned[binID] = float(binVal) / IDs_counts_binned[binID]
-    #return binned_avg(IDs_ranks, IDs_counts, num_bins)
-    return IDs_ranks_binned
-
-# params: artists_albums - the main dictionary we're working with throughout the project (keys are artist names, values are lists of
-#            lists, each sublist containing data about 1 album)
+    return binned_values(table_positions(table)[keep], ranks, num_bins)
+
+# per group statistics of scores, for groups (ie artists) stored one after the other, all groups at once
+# params: scores - array of scores
+#         group_start - where each group starts in scores (the groups must not be empty)
+# returns: dictionary of arrays, per group: 'max', 'num_max' (how many scores are the max), 'argmax' (index in scores of the first max),
+#          'mean' and 'pstdev' (population standard deviation)
+def grouped_stats(scores, group_start):
+    scores = np.asarray(scores, dtype = np.int64)
+    group_size = np.diff(np.append(group_start, len(scores)))
+    group = np.repeat(np.arange(len(group_start)), group_size)
+
+    group_max = np.maximum.reduceat(scores, group_start)
+    is_max = scores == group_max[group]
+    num_max = np.add.reduceat(is_max, group_start)
+    # first max of each group: the max with the fewest maxes before it in its group
+    max_before = np.cumsum(is_max) - is_max
+    argmax = np.flatnonzero(is_max & (max_before == max_before[group_start][group]))
+
+    # sums of the integer scores and their squares are exact, so the mean and variance are only rounded once
+    sums = np.add.reduceat(scores, group_start)
+    squares = np.add.reduceat(scores * scores, group_start)
+    mean = sums / group_size
+    pstdev = np.sqrt((squares * group_size - sums * sums) / (group_size * group_size))
+    return {'max': group_max, 'num_max': num_max, 'argmax': argmax, 'mean': mean, 'pstdev': pstdev}
+
+# params: artists_albums - an AlbumTable, or the main dictionary we're working with throughout the project (keys are artist names,
+#            values are lists of lists, each sublist containing data about 1 album)
 #         which_score - an index # within each sublist (for each album) referring to either the critic's score or the user's score
 #         chance_weighting - since certain index values are more likely to come up in scenarios where they would be a higher rank just by chance
 #                    (ie if there are only 2 albums, there is a 50% chance either one is the highest ranked, but if there are 4, there is a 25% chance for each)
@@ -408,74 +510,40 @@ def get_ranks(artists_albums, which_score, chance_weighting = False, num_bins =
 #            rating for the artist that album is
 # returns: a dictionary where keys are album ID bins, values are, for the album IDs in a given bin, the (weighted) % that they held the top-rated album
 def get_max_indexes(artists_albums, which_score, std_dev_weighted = False, chance_weighting = True, num_bins = 5):
-
-    decimal.getcontext().prec = 3
-
-    # dictionary of the index position in each artist's albums list of the album with the highest rating (critic's)
-    # keys are index pos, values are counts
-    max_indexes = {}
-
-    # dictionary of key = identifer of the album, value = how many of that identifier are in the data at all (for all artists)
-    # ie to account for the fact that different artists will have different numbers of total albums, so the fractions each
-    # artist will have as their album identifiers will be different
-    indexes_count = {}
-    for artist, albums in artists_albums.items():
-        # these are the rating values...
-        # the indexes assigned to each album in artists_albums for this artist ... ie with count (from 0) / (num_albums - 1)
-        # will be the same as the indexes of this array... so no need to add them in here
-        ratings_dict = [this_album[which_score] for this_album in albums]
-
-        if 'tbd' not in ratings_dict:
-
-            max_value = max(ratings_dict)
-            if ratings_dict.count(max_value) == 1:
-
-                # populate indexes count... of all albums, not just those with the max value rating
-                count = decimal.Decimal('0')
-                adj_num_albums = decimal.Decimal(len(albums) - 1)
-                for this_album in albums:
-                    this_index = count / adj_num_albums
-                    if this_index not in indexes_count:
-                        indexes_count[this_index] = [1]
-                    else:
-                        indexes_count[this_index].append(1)
-                    count += 1
-
-                index_max_value = decimal.Decimal(ratings_dict.index(max_value))
-                num_albums_adj = decimal.Decimal(len(albums) - 1)
-                top_album_index = index_max_value / num_albums_adj
-
-                incr = 1.0
-                if chance_weighting:
-                    incr *= len(albums)
-
-                if std_dev_weighted:
-                    # std dev weighting
-                    std_dev = stats.pstdev(ratings_dict) #population since we have all of the artist's albums...
-                    mean = stats.mean(ratings_dict)
-                    incr *= float(max_value - mean) / std_dev
-
-                if top_album_index not in max_indexes:
-                    max_indexes[top_album_index] = [incr]
-                else:
-                    max_indexes[top_album_index].append(incr)
-
-                #print("Artist: ", artist, "Index: ", top_album_index)
-
-        #else:
-            #print("Artist: ", artist, "tbd in ratings_dict")
-
-    # binning
-
-    #print(sorted(max_indexes.items()))
-    max_indexes_hist_binned = binned(max_indexes, num_bins)
-    #print(sorted(max_indexes_hist_binned.items()))
-
-    indexes_count_binned = binned(indexes_count, num_bins)
-    #print(sorted(indexes_count_binned.items()))
-
-    for binID, binVal in max_indexes_hist_binned.items():
-        max_indexes_hist_binned[binID] = float(sum(binVal)) / sum(indexes_count_binned[binID])
-
-    #print(sorted(max_indexes_hist_binned.items()))
-    return max_indexes_hist_binned
+    table = als.as_album_table(artists_albums)
+    scores = np.asarray(table.scores(which_score))
+    artist_id = np.asarray(table.artist_id)
+
+    # artists without 'tbd' scores, with more than one album (a single album has no album ID)
+    has_missing = np.bincount(artist_id[scores == als.MISSING_SCORE], minlength = table.num_artists()) > 0
+    keep = (~has_missing & (table.num_albums > 1))[artist_id]
+    scores = scores[keep]
+    positions = table_positions(table)[keep]
+    num_albums = table.num_albums[~has_missing & (table.num_albums > 1)]
+    if len(num_albums) == 0: # no artist to bin
+        return {}
+    group_start = np.append(0, np.cumsum(num_albums)[:-1])
+
+    # only artists whose highest rating is one album's count
+    artist_stats = grouped_stats(scores, group_start)
+    unique_max = artist_stats['num_max'] == 1
+
+    incr = np.ones(len(num_albums))
+    if chance_weighting:
+        incr *= num_albums
+    if std_dev_weighted:
+        # std dev weighting, population since we have all of the artist's albums...
+        # (0 for artists whose albums all have the same rating, but those don't have a unique max, so aren't used)
+        with np.errstate(invalid = 'ignore'):
+            incr *= (artist_stats['max'] - artist_stats['mean']) / artist_stats['pstdev']
+
+    # binning: the positions of the top albums, and of all albums of those artists, since different artists will have different numbers
+    # of total albums, so the fractions each artist will have as their album identifiers will be different
+    max_indexes_binned = binned_sums(positions[artist_stats['argmax'][unique_max]], incr[unique_max], num_bins)
+    all_positions = positions[np.repeat(unique_max, num_albums)]
+    indexes_count_binned = binned_sums(all_positions, np.ones(len(all_positions)), num_bins)
+
+    for binID, binVal in max_indexes_binned.items():
+        max_indexes_binned[binID] = binVal / indexes_count_binned[binID]
+
+    return max_indexes_binned
@@ -0,0 +1,203 @@
+import time
+import copy
+import json
+import tracemalloc
+from lxml import html
+import utilities as ut
+import preprocessing as pp
+import album_store as als
+
+# micro-benchmarks for the scraping and preprocessing code
+# each prints its timings, and returns them as a dictionary
+
+# param: num_rows - number of releases on the page
+# returns: the html (bytes) of a made up metacritic artist page, with a release table like the real ones
+def synthetic_artist_page(num_rows = 100):
+    rows = []
+    for i in range(num_rows):
+        rows.append('<tr class="' + ('even' if i % 2 == 0 else 'odd') + '">'
+                    '<td class="title brief_metascore"><span class="metascore_w small release positive">' + str(50 + i % 50) + '</span></td>'
+                    '<td class="title product"><a href="/music/album-' + str(i) + '/some-artist"> Album ' + str(i) + ' </a></td>'
+                    '<td class="year release_date"> Mar ' + str(1 + i % 28) + ', ' + str(2000 + i % 17) + ' </td>'
+                    '<td class="role">Primary Artist</td>'
+                    '<td class="score"><span class="data textscore textscore_favorable">' + str(5 + (i % 50) / 10) + '</span></td>'
+                    '</tr>')
+    return ('<html><head><title>Some Artist</title></head><body><div id="main">'
+            '<table class="credits person_credits"><thead><tr><th>Metascore</th><th>Title</th><th>Date</th><th>Role</th><th>User</th></tr></thead>'
+            '<tbody>' + ''.join(rows) + '</tbody></table></div></body></html>').encode('utf-8')
+
+# how get_albums_from_artist_page used to parse an artist page: every xpath string is evaluated (and so parsed again) on every row
+def parse_albums_string_xpath(tree):
+    all_albums = []
+    for album_html in tree.xpath("//table[contains(@class, 'credits')]/tbody/tr"):
+        l = []
+        l.append(album_html.xpath("td/span[contains(@class, 'metascore_w')]/text()"))
+        l.append(album_html.xpath("td/a/text()"))
+        l.append(album_html.xpath("td[contains(@class, 'year')]/text()"))
+        l.append(album_html.xpath("td[contains(@class, 'role')]/text()"))
+        l.append(album_html.xpath("td[contains(@class, 'score')]/span[contains(@class, 'textscore')]/text()"))
+
+        for i in range(len(l)):
+            l[i] = l[i][0].strip()
+
+        all_albums.append(l)
+    return all_albums
+
+# rows parsed per second from artist pages, with string xpaths (before) and the compiled xpaths in utilities.py (after)
+# only the row extraction is timed, each page is parsed into a tree once up front
+# params: file_names - saved metacritic artist pages (.html), defaults to 20 synthetic pages of 100 releases each
+#         repeat - how many times to parse every page
+# returns: dictionary with rows per second for 'before' and 'after'
+def benchmark_album_rows(file_names = None, repeat = 20):
+    if file_names is None:
+        pages = [synthetic_artist_page(100) for _ in range(20)]
+    else:
+        pages = []
+        for file_name in file_names:
+            with open(file_name, 'rb') as f:
+                pages.append(f.read())
+    trees = [html.fromstring(page) for page in pages]
+
+    # both parsers must agree before timing them
+    for tree in trees:
+        if parse_albums_string_xpath(tree) != ut.parse_albums_from_tree(tree):
+            raise ValueError("compiled xpaths parsed a page differently")
+
+    results = {}
+    for name, parse in [('before', parse_albums_string_xpath), ('after', ut.parse_albums_from_tree)]:
+        num_rows = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for tree in trees:
+                num_rows += len(parse(tree))
+        results[name] = num_rows / (time.perf_counter() - start)
+
+    print("rows parsed per second, string xpaths:", "%.0f" % results['before'])
+    print("rows parsed per second, compiled xpaths:", "%.0f" % results['after'])
+    print("speedup:", "%.2f" % (results['after'] / results['before']))
+    return results
+
+# params: num_artists - number of artists
+#         num_albums - number of releases per artist
+# returns: a made up artists_albums dictionary, as scraped (before field_preprocessing): unsorted dates, some 'tbd' scores,
+#          and every fourth release with the artist in another role than "Primary Artist"
+def synthetic_artists_albums(num_artists, num_albums):
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    artists_albums = {}
+    for i in range(num_artists):
+        albums = []
+        for j in range(num_albums):
+            k = (j * 7919 + i) % num_albums # scrambled release order
+            albums.append([str(40 + k % 60) if k % 10 != 0 else 'tbd',
+                           'Album ' + str(k),
+                           months[k % 12] + ' ' + str(1 + k % 28) + ', ' + str(2000 + k // 12 % 17),
+                           'Primary Artist' if k % 4 != 0 else 'Producer',
+                           str((k % 100) / 10) if k % 9 != 0 else 'tbd'])
+        artists_albums['Artist ' + str(i)] = albums
+    return artists_albums
+
+# how field_preprocessing used to work: a strptime per album, and removing the non-"Primary Artist" albums with a list membership test
+# per album (which compares whole albums), so quadratic in the number of albums per artist
+def field_preprocessing_quadratic(artists_albums):
+    artists_to_remove = set()
+    for artist, albums in artists_albums.items():
+        albums_to_remove = []
+        for this_album in albums:
+            try:
+                this_album[0] = int(this_album[0])
+            except:
+                pass
+            try:
+                this_album[4] = int(float(this_album[4]) * 10)
+            except:
+                pass
+            this_album.append(pp.date_formatting(this_album[2]))
+            if this_album[3].find("Primary Artist") == -1:
+                albums_to_remove.append(this_album)
+
+        albums = [this_album for this_album in albums if this_album not in albums_to_remove]
+        if len(albums) <= 0:
+            artists_to_remove.add(artist)
+        else:
+            artists_albums[artist] = albums
+            artists_albums[artist].sort(key = lambda this_album : this_album[5])
+
+    for artist in artists_to_remove:
+        del artists_albums[artist]
+
+# the numbers of releases per artist benchmark_field_preprocessing tries by default
+FIELD_PREPROCESSING_ALBUMS_PER_ARTIST = [10, 100, 300, 1000]
+
+# seconds taken by the old (field_preprocessing_quadratic) and current field_preprocessing, for artists with more and more releases
+# params: albums_per_artist - list of numbers of releases per artist to try (FIELD_PREPROCESSING_ALBUMS_PER_ARTIST if None)
+#         total_albums - about how many releases in total for each try (so the number of artists goes down as the releases per artist go up)
+# returns: dictionary with keys = number of releases per artist, values = (old seconds, new seconds)
+def benchmark_field_preprocessing(albums_per_artist = None, total_albums = 30000):
+    if albums_per_artist is None:
+        albums_per_artist = FIELD_PREPROCESSING_ALBUMS_PER_ARTIST
+    results = {}
+    for num_albums in albums_per_artist:
+        artists_albums = synthetic_artists_albums(max(1, total_albums // num_albums), num_albums)
+        old_albums = copy.deepcopy(artists_albums)
+
+        start = time.perf_counter()
+        field_preprocessing_quadratic(old_albums)
+        old_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pp.field_preprocessing(artists_albums)
+        new_seconds = time.perf_counter() - start
+
+        if old_albums != artists_albums:
+            raise ValueError("field_preprocessing and field_preprocessing_quadratic disagree")
+
+        results[num_albums] = (old_seconds, new_seconds)
+        print(num_albums, "releases per artist: old", "%.3f" % old_seconds, "s, new", "%.3f" % new_seconds, "s, speedup", "%.1f" % (old_seconds / new_seconds))
+    return results
+
+# param: build - function building something
+# returns: (what it built, bytes allocated while building it that are still in use)
+def traced_bytes(build):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        built = build()
+        return built, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+# bytes per album of the preprocessed dataset, with albums as the lists field_preprocessing leaves (before) and as Album records (after)
+# both are built from the same json, and everything that stays in memory is counted (dictionary, artist names and album titles included)
+# params: file_names - genre .json files, defaults to 10000 synthetic artists with 10 releases each
+# returns: dictionary with bytes per album for 'before' and 'after'
+def benchmark_album_memory(file_names = None):
+    if file_names is None:
+        documents = [json.dumps(synthetic_artists_albums(10000, 10))]
+    else:
+        documents = []
+        for file_name in file_names:
+            with open(file_name) as f:
+                documents.append(f.read())
+
+    def build_lists():
+        artists_albums = pp.dictionary_union([json.loads(document) for document in documents])
+        pp.field_preprocessing(artists_albums)
+        return artists_albums
+
+    def build_records():
+        artists_albums = build_lists()
+        pp.albums_to_records(artists_albums)
+        return artists_albums
+
+    lists, list_bytes = traced_bytes(build_lists)
+    records, record_bytes = traced_bytes(build_records)
+    if {artist : [als.Album.from_list(this_album) for this_album in albums] for artist, albums in lists.items()} != records:
+        raise ValueError("Album records differ from the album lists")
+
+    num_albums = sum(len(albums) for albums in lists.values())
+    results = {'before': list_bytes / num_albums, 'after': record_bytes / num_albums}
+    print(num_albums, "albums")
+    print("bytes per album, lists:", "%.1f" % results['before'])
+    print("bytes per album, Album records:", "%.1f" % results['after'])
+    print("saving:", "%.2f" % (results['before'] / results['after']))
+    return results
@@ -0,0 +1,108 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import utilities as ut
+import fetching as fe
+
+# checks that every mode of get_artists_from_genres (sequential, concurrent, streaming) finds the same artists, by crawling a local
+# stand-in for metacritic serving canned browse, album and artist pages, instead of the real site
+# run it with: python crawl_check.py
+
+# number of browse pages of each canned genre
+STANDIN_GENRES = {'rock': 3, 'pop': 2}
+
+# put before <html> on some pages (pop's browse pages and Artist7's album pages), as metacritic's old IE conditional comments were. the
+# streaming parser must not try to delete these siblings of the root
+LEADING_COMMENT = '<!--[if lt IE 9]><script src="/html5shiv.js"></script><![endif]-->'
+
+# params: g - genre
+#         page - browse page number (from 0)
+# returns: the html of a canned browse page, laid out like metacritic's: 4 releases, by artists shared between pages and genres (pop's
+#          starting with LEADING_COMMENT)
+def standin_browse_page(g, page):
+    items = ''
+    for k in range(4):
+        artist = 'Artist' + str((page * 4 + k + (7 if g == 'pop' else 0)) % 10)
+        # a title split by markup (on one release per page), which must not put later titles out of step
+        title = 'Record <em>Deluxe</em> Edition' if k == 1 else 'Record ' + str(page)
+        items += ('<li class="product release_product"><div class="basic_stat product_title"><a href="/music/' + artist + '-' + g + '-' + str(page) + '">'
+                  + title + '</a></div><ul class="more_stats"><li class="stat product_artist"><span class="label">Artist:</span>'
+                  '<span class="data">' + artist + '</span></li></ul></li>')
+    return ((LEADING_COMMENT if g == 'pop' else '') + '<html><body><ol class="list_products">' + items + '</ol><ul class="pages"><li class="page last_page">'
+            '<a class="page_num" href="?page=' + str(STANDIN_GENRES[g] - 1) + '">' + str(STANDIN_GENRES[g]) + '</a></li></ul></body></html>')
+
+# param: path - album page path, /music/<artist>-<genre>-<page>
+# returns: the html of a canned album page, linking to the artist page. Artist3's first album page has no link (so their next
+#          album is tried), and none of Artist5's do (so they are left out). Artist7's start with LEADING_COMMENT
+def standin_album_page(path):
+    artist = path.split('/')[2].split('-')[0]
+    if artist == 'Artist5' or path == '/music/Artist3-rock-0':
+        return '<html><body><div class="product_artist">' + artist + '</div></body></html>'
+    return ((LEADING_COMMENT if artist == 'Artist7' else '') + '<html><body><div class="product_artist"><a href="/person/' + artist.lower() + '">' + artist + '</a></div></body></html>')
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/browse/albums/genre/date/'):
+            body = standin_browse_page(url.path.rsplit('/', 1)[1], int(parse_qs(url.query).get('page', ['0'])[0]))
+        elif url.path.startswith('/music/'):
+            body = standin_album_page(url.path)
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# returns: the stand-in server, serving in a background thread (its base url is 'http://127.0.0.1:' + str(server.server_address[1]))
+def start_standin():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandinHandler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+# crawls the stand-in's genres in every mode, and raises AssertionError if any of them finds different artists
+# returns: the artists dictionary they all found
+def check_crawl_modes():
+    server = start_standin()
+    old_url = ut.METACRITIC_URL
+    old_scheduler = fe.get_scheduler()
+    ut.METACRITIC_URL = 'http://127.0.0.1:' + str(server.server_address[1])
+    fe.configure_scheduler(rate = 1000, max_rate = 1000, burst = 100)
+    try:
+        genres = list(STANDIN_GENRES)
+        sequential = ut.get_artists_from_genres(genres)
+        modes = {'concurrent': ut.get_artists_from_genres(genres, max_workers = 8),
+                 'streaming': ut.get_artists_from_genres(genres, streaming = True),
+                 'concurrent streaming': ut.get_artists_from_genres(genres, max_workers = 8, streaming = True)}
+
+        expected = {'Artist' + str(i): '/person/artist' + str(i) for i in [0, 1, 2, 3, 4, 6, 7, 8, 9]}
+        assert sequential == expected, "sequential crawl found " + str(sequential)
+        for mode, artists in modes.items():
+            assert artists == sequential, mode + " crawl found " + str(artists) + ", sequential found " + str(sequential)
+
+        releases = ut.get_genre_page_releases('rock', 0)
+        assert releases == ut.get_genre_page_releases('rock', 0, streaming = True), "streaming found different releases"
+        assert [title for artist, title, album_url in releases] == ['Record 0', 'Record Deluxe Edition', 'Record 0', 'Record 0'], releases
+    finally:
+        ut.METACRITIC_URL = old_url
+        fe.set_scheduler(old_scheduler)
+        server.shutdown()
+        server.server_close()
+
+    print("all crawl modes found the same", len(sequential), "artists")
+    return sequential
+
+if __name__ == '__main__':
+    check_crawl_modes()
@@ -0,0 +1,505 @@
+import threading
+import atexit
+import hashlib
+import json
+import os
+import random
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+# shared http layer for the scraper functions in utilities.py
+# all requests go through one requests.Session, so connections are kept alive between requests
+# (with a connection pool per host) and the headers are only built once
+# responses can also be kept in an on-disk ResponseCache (see use_cache), so a repeated crawl only re-downloads stale pages
+# large pages can be read in chunks with iter_content, instead of holding the whole body in memory
+# requests are throttled per host by a HostScheduler, which backs off when the host answers 429 or 5xx and retries a few times
+
+USER_AGENT = 'Mozilla/5.0'
+
+_session = None
+_session_lock = threading.Lock()
+
+_cache = None
+
+# response statuses meaning the host is overloaded (or rate limiting us), so the request should be retried more slowly
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# params: pool_connections - number of hosts to keep a connection pool for
+#         pool_maxsize - number of connections kept alive per host... should be at least the number of threads crawling a host
+#         user_agent - sent with every request
+# returns: a new requests.Session with those pool sizes
+def make_session(pool_connections = 10, pool_maxsize = 10, user_agent = USER_AGENT):
+    session = requests.Session()
+    session.headers.update({'User-Agent': user_agent})
+
+    adapter = HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+# returns: the shared session, created with the default pool sizes on first use
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+# replace the shared session, ie with one from make_session with bigger pools, or a stand-in for a local mirror
+# param: session - a requests.Session (or anything with the same get method)
+# returns: the previous shared session
+def set_session(session):
+    global _session
+    with _session_lock:
+        old_session = _session
+        _session = session
+        return old_session
+
+# param: same as make_session
+# returns: the new shared session
+def configure_session(pool_connections = 10, pool_maxsize = 10, user_agent = USER_AGENT):
+    session = make_session(pool_connections, pool_maxsize, user_agent)
+    set_session(session)
+    return session
+
+# raised when a request is dropped, ie still failing after all of its retries
+class FetchError(Exception):
+    pass
+
+# token bucket, holding up to capacity tokens and refilled with rate tokens per second
+# each request takes 1 token, waiting for it if the bucket is empty
+# the rate adapts to the host: it is halved (down to min_rate) when the host pushes back, and slowly raised again (up to max_rate) while requests succeed
+class TokenBucket:
+    def __init__(self, rate, capacity, min_rate, max_rate, rate_increase):
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_increase = rate_increase
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.rate_increase)
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+# sends requests through one TokenBucket per host, retrying those that fail
+# a request is retried (at most max_retries times) on connection errors and RETRY_STATUSES responses, waiting a random time between 0 and
+# backoff * 2 ^ attempt seconds (capped at max_backoff), or as long as the host asks for with a Retry-After header
+# metrics counts requests sent, retries, dropped requests (that failed every retry) and throttled responses (429 / 5xx)
+# any other response that isn't 2xx or 304 (ie 403 when the host blocks us, or 404) is refused: it is not retried, but raised as a
+# FetchError straight away, so the scrapers never parse an error page as a page without results (403 also slows the host down)
+# every request gives up after connect_timeout seconds without a connection, or read_timeout seconds without any data from the host,
+# which counts as a connection error (so is retried, and dropped if it keeps happening)
+class HostScheduler:
+    def __init__(self, rate = 5.0, max_rate = 20.0, min_rate = 0.2, burst = 5, rate_increase = 0.1,
+                 max_retries = 4, backoff = 1.0, max_backoff = 60.0, connect_timeout = 10.0, read_timeout = 30.0):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.rate_increase = rate_increase
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self.buckets = {}
+        self.metrics = {'requests': 0, 'retried': 0, 'dropped': 0, 'throttled': 0, 'refused': 0}
+        self.lock = threading.Lock()
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst, self.min_rate, self.max_rate, self.rate_increase)
+            return self.buckets[host]
+
+    def count(self, metric):
+        with self.lock:
+            self.metrics[metric] += 1
+
+    # returns: metrics, plus the current request rate for each host
+    def get_metrics(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+            metrics['rates'] = {host: bucket.rate for host, bucket in self.buckets.items()}
+            return metrics
+
+    # returns: how long to wait before retry number attempt + 1
+    def retry_delay(self, attempt, response):
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(self.max_backoff, int(response.headers['Retry-After']))
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    # params: session - session to send the request with
+    #         url - the full url to get
+    #         headers - extra headers for this request only
+    #         stream - don't download the body until it is read, see requests' stream argument
+    # returns: the response, with a 2xx status or 304
+    # raises: FetchError if the request was dropped, or refused
+    def request(self, session, url, headers = None, stream = False):
+        bucket = self.bucket(urlparse(url).netloc)
+        kwargs = {'timeout': (self.connect_timeout, self.read_timeout)}
+        if headers:
+            kwargs['headers'] = headers
+        if stream:
+            kwargs['stream'] = True
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.count('retried')
+                time.sleep(self.retry_delay(attempt - 1, response))
+
+            bucket.acquire()
+            self.count('requests')
+            try:
+                response = session.get(url, **kwargs)
+            except requests.RequestException as e:
+                error = e
+                response = None
+                bucket.throttled()
+                continue
+
+            if response.status_code in RETRY_STATUSES:
+                error = 'status ' + str(response.status_code)
+                response.close()
+                self.count('throttled')
+                bucket.throttled()
+                continue
+
+            if not (200 <= response.status_code < 300 or response.status_code == 304):
+                response.close()
+                self.count('refused')
+                if response.status_code == 403:
+                    bucket.throttled()
+                raise FetchError(url + ' refused (status ' + str(response.status_code) + ')')
+
+            bucket.succeeded()
+            return response
+
+        self.count('dropped')
+        raise FetchError(url + ' dropped after ' + str(self.max_retries) + ' retries (' + str(error) + ')')
+
+_scheduler = HostScheduler()
+
+# params: same as HostScheduler
+# returns: the new HostScheduler used by get
+def configure_scheduler(**kwargs):
+    global _scheduler
+    _scheduler = HostScheduler(**kwargs)
+    return _scheduler
+
+# returns: the HostScheduler used by get
+def get_scheduler():
+    return _scheduler
+
+# param: scheduler - HostScheduler for get to use from now on (ie the one get_scheduler returned before a configure_scheduler)
+# returns: the previous HostScheduler
+def set_scheduler(scheduler):
+    global _scheduler
+    old_scheduler = _scheduler
+    _scheduler = scheduler
+    return old_scheduler
+
+# on-disk http response cache
+# each response body is saved in directory under the sha256 of its url, and index.json holds, for each url:
+# when it was fetched, when it was last used, its size, and its ETag / Last-Modified headers (if the server sent them)
+# a cached response is used as is until it is older than ttl, after that it is revalidated with a conditional request
+# when the bodies add up to more than max_bytes, the least recently used ones are removed
+# index.json is only rewritten every index_interval stores / revalidations, and by save (which save_cache calls at the end of a crawl,
+# and at exit), not on every response. bodies stored after the last write are not in it, so they are removed when the cache is opened
+class ResponseCache:
+    def __init__(self, directory, ttl = 7 * 24 * 60 * 60, max_bytes = 500 * 1024 * 1024, index_interval = 100):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.index_interval = index_interval
+        self.lock = threading.Lock()
+        self.dirty = False # index changed since index.json was written
+        self.unsaved = 0 # stores and revalidations since index.json was written
+
+        os.makedirs(directory, exist_ok = True)
+        self.index_file = os.path.join(directory, 'index.json')
+        self.index = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                self.index = json.load(f)
+        self.total_bytes = sum(entry['size'] for entry in self.index.values())
+
+        # bodies (and partly written .tmp files) left over from a crawl that ended before the index was written
+        for name in os.listdir(directory):
+            key = name.split('.')[0]
+            if self.is_key(key) and (name == key or name.endswith('.tmp')) and name not in self.index:
+                os.remove(os.path.join(directory, name))
+
+    def key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    # whether name is a key (so a file named after it is one of the cache's)
+    def is_key(self, name):
+        return len(name) == 64 and all(c in '0123456789abcdef' for c in name)
+
+    def body_file(self, key):
+        return os.path.join(self.directory, key)
+
+    # returns: (entry, body) for url, or (None, None) if url is not cached
+    def lookup(self, url):
+        entry, body_file = self.lookup_file(url)
+        if entry is None:
+            return None, None
+        with body_file:
+            return entry, body_file.read()
+
+    # returns: (entry, the body file opened for reading) for url, or (None, None) if url is not cached
+    #          the caller must close the file
+    def lookup_file(self, url):
+        key = self.key(url)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None, None
+            try:
+                body_file = open(self.body_file(key), 'rb')
+            except FileNotFoundError: # body removed by hand, so forget about it
+                self.total_bytes -= entry['size']
+                del self.index[key]
+                return None, None
+            entry['used_at'] = time.time()
+            self.dirty = True
+            return entry, body_file
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    # returns: headers to make a request for a stale entry conditional
+    def validators(self, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    # save a (200) response body for url
+    def store(self, url, body, headers):
+        key = self.key(url)
+        now = time.time()
+        with self.lock:
+            tmp_file = self.body_file(key) + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_file, self.body_file(key))
+
+            if key in self.index:
+                self.total_bytes -= self.index[key]['size']
+            self.index[key] = {'url': url, 'fetched_at': now, 'used_at': now, 'size': len(body),
+                               'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+            self.total_bytes += len(body)
+
+            self.evict()
+            self.changed()
+
+    # save a (200) response body for url, while it is being streamed
+    # params: chunks - iterator over the body
+    # yields: the same chunks. the body is only saved once all of them have been read
+    def store_chunks(self, url, chunks, headers):
+        key = self.key(url)
+        tmp_file = self.body_file(key) + '.' + str(threading.get_ident()) + '.tmp'
+        size = 0
+        complete = False
+        try:
+            with open(tmp_file, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if not complete:
+                os.remove(tmp_file)
+
+        now = time.time()
+        with self.lock:
+            os.replace(tmp_file, self.body_file(key))
+
+            if key in self.index:
+                self.total_bytes -= self.index[key]['size']
+            self.index[key] = {'url': url, 'fetched_at': now, 'used_at': now, 'size': size,
+                               'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+            self.total_bytes += size
+
+            self.evict()
+            self.changed()
+
+    # the server said the cached body for url is still current (304), so it is fresh again
+    def refresh(self, url):
+        key = self.key(url)
+        with self.lock:
+            if key in self.index:
+                self.index[key]['fetched_at'] = time.time()
+                self.changed()
+
+    # remove least recently used bodies until they fit in max_bytes. call with self.lock held
+    def evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key, entry in sorted(self.index.items(), key = lambda kv : kv[1]['used_at']):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(self.body_file(key))
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= entry['size']
+            del self.index[key]
+
+    # count a store or revalidation, writing index.json every index_interval of them. call with self.lock held
+    def changed(self):
+        self.dirty = True
+        self.unsaved += 1
+        if self.unsaved >= self.index_interval:
+            self.save_index()
+
+    # write index.json. call with self.lock held
+    def save_index(self):
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_file, self.index_file)
+        self.dirty = False
+        self.unsaved = 0
+
+    # write index.json if anything changed since it was last written, ie at the end of a crawl
+    def save(self):
+        with self.lock:
+            if self.dirty:
+                self.save_index()
+
+# stands in for a requests response, when the body comes from the cache
+class CachedResponse:
+    def __init__(self, url, content):
+        self.url = url
+        self.content = content
+        self.status_code = 200
+        self.headers = {}
+        self.from_cache = True
+
+# params: directory - where to keep cached responses, or None to stop caching
+#         ttl, max_bytes, index_interval - see ResponseCache
+# returns: the new ResponseCache (or None)
+def use_cache(directory, ttl = 7 * 24 * 60 * 60, max_bytes = 500 * 1024 * 1024, index_interval = 100):
+    global _cache
+    save_cache()
+    _cache = ResponseCache(directory, ttl, max_bytes, index_interval) if directory is not None else None
+    return _cache
+
+# write the index of the cache in use (if any) to disk. called at the end of each crawl, and at exit
+def save_cache():
+    if _cache is not None:
+        _cache.save()
+
+atexit.register(save_cache)
+
+# returns: the ResponseCache used by get, or None if responses are not cached
+def get_cache():
+    return _cache
+
+# params: url - the full url to get
+#         session - session to send the request with, defaults to the shared session
+# returns: the response. if a cache is in use, a fresh cached copy is returned without a request,
+#          and a stale one is only downloaded again if it changed on the server
+# raises: FetchError if the request was dropped or refused by the scheduler
+def get(url, session = None):
+    if session is None:
+        session = get_session()
+
+    cache = _cache
+    if cache is None:
+        return _scheduler.request(session, url)
+
+    entry, body = cache.lookup(url)
+    if entry is not None and cache.is_fresh(entry):
+        return CachedResponse(url, body)
+
+    if entry is not None:
+        response = _scheduler.request(session, url, cache.validators(entry))
+    else:
+        response = _scheduler.request(session, url)
+
+    if response.status_code == 304 and entry is not None:
+        cache.refresh(url)
+        return CachedResponse(url, body)
+    if response.status_code == 200:
+        cache.store(url, response.content, response.headers)
+    return response
+
+# like get, but the body is read chunk_size bytes at a time instead of all at once
+# cached bodies are read from disk the same way, and a downloaded body is written to the cache as it is read
+# params: url - the full url to get
+#         session - session to send the request with, defaults to the shared session
+#         chunk_size - max number of bytes per chunk
+# yields: the response body, in chunks (bytes)
+# raises: FetchError if the request was dropped or refused by the scheduler
+def iter_content(url, session = None, chunk_size = 64 * 1024):
+    if session is None:
+        session = get_session()
+
+    cache = _cache
+    entry = None
+    if cache is not None:
+        entry, body_file = cache.lookup_file(url)
+        if entry is not None:
+            if cache.is_fresh(entry):
+                yield from iter_file(body_file, chunk_size)
+                return
+            body_file.close()
+
+    if entry is not None:
+        response = _scheduler.request(session, url, cache.validators(entry), stream = True)
+    else:
+        response = _scheduler.request(session, url, stream = True)
+
+    try:
+        if response.status_code == 304 and entry is not None:
+            cache.refresh(url)
+            entry, body_file = cache.lookup_file(url)
+            if entry is not None:
+                yield from iter_file(body_file, chunk_size)
+            return
+
+        chunks = response.iter_content(chunk_size)
+        if cache is not None and response.status_code == 200:
+            chunks = cache.store_chunks(url, chunks, response.headers)
+        yield from chunks
+    finally:
+        response.close()
+
+# yields: the contents of an open (binary) file, in chunks. closes the file at the end
+def iter_file(body_file, chunk_size):
+    with body_file:
+        chunk = body_file.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = body_file.read(chunk_size)
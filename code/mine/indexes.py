@@ -0,0 +1,125 @@
+import os
+from bisect import bisect_left
+import numpy as np
+import album_store as als
+import preprocessing as pp
+
+# secondary indexes over an AlbumTable (see album_store.py), so lookups don't have to scan every artist's albums
+# - albums by date: album ids sorted by release date, range queries are a binary search
+# - artists by number of albums: artist ids sorted by album count, with where each count starts, so a count query is a lookup
+# - artists by name: a dictionary for exact names, and the names sorted for prefix queries (binary search)
+# - artists by genre: a bitmap per artist, bit g set if the artist is in genre g
+# queries return numpy arrays of album ids or artist ids, ie positions in the table's arrays / artist_names
+
+# param: d - a date or datetime, or already a date ordinal (int)
+# returns: its date ordinal, as stored in AlbumTable.date
+def date_ordinal(d):
+    if isinstance(d, (int, np.integer)):
+        return int(d)
+    return d.toordinal()
+
+# param: filename - a genre file, ie '../data/rock-artists-albums.json'
+# returns: the genre's name, ie 'rock'
+def genre_name(filename):
+    name = os.path.basename(os.path.normpath(filename))
+    for suffix in ['.jsonl', '.json', '-artists-albums']:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+class AlbumIndex:
+    # params: table - the AlbumTable
+    #         genre_artists - dictionary of keys = genre name, values = iterable of the names of the genre's artists (artists not in
+    #                         the table are ignored). at most 64 genres, none if None
+    def __init__(self, table, genre_artists = None):
+        self.table = table
+        if genre_artists is None:
+            genre_artists = {}
+
+        dates = np.asarray(table.date)
+        self.date_order = np.argsort(dates, kind = 'stable')
+        self.sorted_dates = dates[self.date_order]
+
+        counts = table.num_albums
+        self.count_order = np.argsort(counts, kind = 'stable')
+        self.count_start = np.searchsorted(counts[self.count_order], np.arange(counts.max(initial = 0) + 2))
+
+        self.artist_ids = {}
+        for i, artist in enumerate(table.artist_names):
+            self.artist_ids.setdefault(artist, i)
+        self.sorted_names = sorted(self.artist_ids)
+        self.sorted_name_ids = np.array([self.artist_ids[name] for name in self.sorted_names], dtype = np.int32)
+
+        if len(genre_artists) > 64:
+            raise ValueError("at most 64 genres can be indexed, not " + str(len(genre_artists)))
+        self.genres = list(genre_artists)
+        self.genre_bits = np.zeros(table.num_artists(), dtype = np.uint64)
+        for g, artists in enumerate(genre_artists.values()):
+            ids = [self.artist_ids[artist] for artist in artists if artist in self.artist_ids]
+            self.genre_bits[ids] |= np.uint64(1 << g)
+
+    # index a table built from genre files (ie with preprocessing.cached_album_table), with a genre per file
+    # params: table - the AlbumTable
+    #         filenames - the genre files (.json, .jsonl or sharded store directories, see preprocessing.iter_artists_albums)
+    @classmethod
+    def from_genre_files(cls, table, filenames):
+        return cls(table, {genre_name(filename): [artist for artist, _ in pp.iter_artists_albums(filename)] for filename in filenames})
+
+    # params: start, end - dates (or date ordinals)
+    # returns: ids of the albums released from start up to, not including, end, by date
+    def albums_between(self, start, end):
+        lo, hi = np.searchsorted(self.sorted_dates, [date_ordinal(start), date_ordinal(end)])
+        return self.date_order[lo:hi]
+
+    # param: year
+    # returns: ids of the albums released in the year, by date
+    def albums_in_year(self, year):
+        return self.albums_between(np.datetime64(str(year), 'D').astype(np.int64) + als.EPOCH_ORDINAL,
+                                   np.datetime64(str(year + 1), 'D').astype(np.int64) + als.EPOCH_ORDINAL)
+
+    # params: min_albums - least number of albums
+    #         max_albums - most number of albums, no limit if None
+    # returns: ids of the artists with that many albums, by number of albums (then by id)
+    def artists_with_num_albums(self, min_albums, max_albums = None):
+        last = len(self.count_start) - 1
+        lo = self.count_start[min(max(min_albums, 0), last)]
+        hi = self.count_start[last] if max_albums is None else self.count_start[min(max(max_albums + 1, 0), last)]
+        return self.count_order[lo:max(lo, hi)]
+
+    # param: artist - artist name
+    # returns: the artist's id, or None if the artist isn't in the table
+    def artist_id(self, artist):
+        return self.artist_ids.get(artist)
+
+    # param: prefix - start of artist names
+    # returns: ids of the artists whose name starts with prefix, by name
+    def artists_with_prefix(self, prefix):
+        lo = bisect_left(self.sorted_names, prefix)
+        hi = bisect_left(self.sorted_names, prefix + '\U0010ffff', lo) # after every name starting with prefix
+        return self.sorted_name_ids[lo:hi]
+
+    # params: artist - artist name or id
+    #         genre - genre name
+    # returns: whether the artist is in the genre
+    def in_genre(self, artist, genre):
+        if isinstance(artist, str):
+            artist = self.artist_ids.get(artist)
+            if artist is None:
+                return False
+        return bool(self.genre_bits[artist] & np.uint64(1 << self.genres.index(genre)))
+
+    # params: genres - genre names
+    #         match_all - if true, the artists in all of the genres, otherwise the artists in any of them
+    # returns: ids of those artists, by id
+    def artists_in_genres(self, genres, match_all = False):
+        mask = np.uint64(0)
+        for genre in genres:
+            mask |= np.uint64(1 << self.genres.index(genre))
+        matched = self.genre_bits & mask
+        return np.flatnonzero(matched == mask if match_all else matched != 0)
+
+    # param: artist_ids - artist ids
+    # returns: ids of all of those artists' albums, artist by artist
+    def albums_of(self, artist_ids):
+        starts = self.table.artist_start
+        return np.concatenate([np.arange(starts[i], starts[i + 1]) for i in artist_ids] + [np.zeros(0, dtype = np.int64)])
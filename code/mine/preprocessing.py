@@ -1,7 +1,22 @@
 import json
 from datetime import datetime as dt
 import copy
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import ChainMap
+from types import MappingProxyType
+import numpy as np
+from itertools import islice
+import os
+import warnings
 import utilities as ut
+import fetching as fe
+import album_store as als
+
+try:
+    import ijson
+except ImportError: # optional, for iter_artists_albums
+    ijson = None
 
 # reformat data structure
 # was dictionary where keys were artist names, and values were lists of lists, where each sublist represented an album
@@ -40,6 +55,12 @@ def dictionary_union(list_of_dicts):
     '''
 
 
+# same as dictionary_union, but nothing is copied: returns a read-only view of the union, over the dicts themselves
+# like dictionary_union, if a key is in more than one dict, the value from the last one is used, and keys are in the same order
+# the album lists are shared with the dicts, so any change to them shows up in both
+def dictionary_union_view(list_of_dicts):
+    return MappingProxyType(ChainMap(*reversed(list_of_dicts)))
+
 # remove all artists from artists_albums dictionary that have released an album before or during the year specified
 # params: artists_albums - the usual dictionary. note, the albums for each artist ARE ALREADY SORTED!!! from earliest to latest date
 #         year - remove artists if have album during or before this year
@@ -64,18 +85,83 @@ def artists_after(artists_albums, year):
     # print("Length after: ", len(artists_albums))
 
 
+# same as artists_after, but without copying the albums: returns a read-only view of artists_albums with the artists removed
+# (only the artists are looped over, and the album lists are shared with artists_albums)
+# for an AlbumTable, see AlbumTable.artists_after_mask
+def artists_after_view(artists_albums, year):
+    artists_kept = {}
+    for artist, albums in artists_albums.items():
+        try:
+            if int(albums[0][2][-4:]) <= year:
+                continue
+        except:
+            pass
+        artists_kept[artist] = albums
+    return MappingProxyType(artists_kept)
+
+
 # for a given genre, produce a dictionary keys = artists and values = list of lists of that artists albums, if that artist
 # did not release an album before 2000 (which would not have been included in Metacritic's DB, so that whole artist must be scrapped)
 
+# progress is journaled to checkpoint_file (json-lines): the first record is the artists dictionary left after the allmusic check,
+# then one record per artist whose page has been fetched. if the crawl is interrupted, running it again with resume = True
+# skips everything already in the journal. the journal is removed once file_name is saved, unless some artists were dropped
+# (their artist page, or their allmusic pages, could not be downloaded). resuming tries the dropped artists again
+# the artists found in the genres but left out of file_name are saved to file_name + '.excluded', for update_artists_albums
+
 # params: genres - a list of strings of genre names (each needs to be a genre on Metacritic)
 #         file_name - name of the .json file (including extension) to which the artists_albums dictionary should be saved
-
-def get_and_save_artists_albums(genres, file_name):
-    artists = ut.get_artists_from_genres(genres)
-    print(len(artists), " artists in this genre on metacritic")
-
-    ut.earliest_album_date_allmusic(artists)
-    print(len(artists), " after considering earliest album date")
+#         session - requests session to scrape with, defaults to the shared session from fetching.py
+#         checkpoint_file - name of the journal file, defaults to file_name + '.checkpoint'
+#         resume - continue from checkpoint_file if it exists, instead of starting over
+#         max_workers - number of requests to make at once while finding the artists and checking them on allmusic
+#         streaming - parse metacritic pages as they download (see utilities.stream_extract), to keep memory use flat
+
+def get_and_save_artists_albums(genres, file_name, session = None, checkpoint_file = None, resume = False, max_workers = 1, streaming = False):
+    if checkpoint_file is None:
+        checkpoint_file = file_name + '.checkpoint'
+
+    artists = None
+    done = {}
+    if resume and os.path.exists(checkpoint_file):
+        records = ut.read_json_lines(checkpoint_file)
+        for record in records:
+            if 'artists' in record:
+                artists = record['artists']
+                excluded = record.get('excluded', [])
+                unchecked = record.get('unchecked', {})
+            else:
+                done[record['artist']] = record['albums']
+
+        # artists that could not be checked on allmusic last time are checked again
+        if artists is not None and len(unchecked) > 0:
+            rechecked = dict(unchecked)
+            still_unchecked = ut.earliest_album_date_allmusic(rechecked, session, max_workers)
+            artists.update(rechecked)
+            excluded += [artist for artist in unchecked if artist not in rechecked and artist not in still_unchecked]
+            unchecked = still_unchecked
+            records = [{'artists': artists, 'excluded': excluded, 'unchecked': unchecked}] + [record for record in records if 'artists' not in record]
+
+        # rewrite the journal without any partly written last record, so new records start on their own line
+        with open(checkpoint_file + '.tmp', 'w') as journal:
+            for record in records:
+                journal.write(json.dumps(record) + '\n')
+        os.replace(checkpoint_file + '.tmp', checkpoint_file)
+        print("resuming from ", checkpoint_file, ", ", len(done), " artists already fetched")
+
+    if artists is None:
+        unresolved = set()
+        artists = ut.get_artists_from_genres(genres, max_workers, session, streaming, unresolved = unresolved)
+        print(len(artists), " artists in this genre on metacritic")
+        print(len(unresolved), " artists without an artist page link")
+
+        all_artists = list(artists.keys())
+        unchecked = ut.earliest_album_date_allmusic(artists, session, max_workers)
+        print(len(artists), " after considering earliest album date")
+        excluded = sorted(unresolved) + [artist for artist in all_artists if artist not in artists and artist not in unchecked]
+
+        with open(checkpoint_file, 'w') as journal:
+            ut.append_json_line({'artists': artists, 'excluded': excluded, 'unchecked': unchecked}, journal)
 
     artists_albums = {}
 
@@ -87,31 +173,220 @@ def get_and_save_artists_albums(genres, file_name):
 
     count_no_artist_page = 0
     count_le1_album = 0
+    count_dropped = 0
 
-    for artist, artist_url in artists.items():
-        # for progress tracking ONLY...
-        print(cur_artist, " of ", num_artists)
-        cur_artist += 1
-
-        this_artist_albums = ut.get_albums_from_artist_page(artist_url)
-        # removing artists with only 1 album
-        if this_artist_albums != None: #and len(this_artist_albums) > 1:
-            artists_albums[artist] = this_artist_albums
-        else:
-            count_no_artist_page += 1
-        '''
-        elif this_artist_albums == None:
-            count_no_artist_page += 1
-        else: # len(this_artist_albums) <= 1
-            count_le1_album += 1
-        '''
+    with open(checkpoint_file, 'a') as journal:
+        for artist, artist_url in artists.items():
+            # for progress tracking ONLY...
+            print(cur_artist, " of ", num_artists)
+            cur_artist += 1
+
+            if artist in done:
+                this_artist_albums = done[artist]
+            else:
+                try:
+                    this_artist_albums = ut.get_albums_from_artist_page(artist_url, session, streaming)
+                except fe.FetchError as e: # not journaled, so a resumed crawl will try this artist again
+                    print(e)
+                    count_dropped += 1
+                    continue
+                ut.append_json_line({'artist': artist, 'albums': this_artist_albums}, journal)
+
+            # removing artists with only 1 album
+            if this_artist_albums != None: #and len(this_artist_albums) > 1:
+                artists_albums[artist] = this_artist_albums
+            else:
+                count_no_artist_page += 1
+                excluded.append(artist)
+            '''
+            elif this_artist_albums == None:
+                count_no_artist_page += 1
+            else: # len(this_artist_albums) <= 1
+                count_le1_album += 1
+            '''
 
     print(count_no_artist_page, " removed because could not find artist page on metacritic")
     print(count_le1_album, " removed because <= 1 album")
+    print(count_dropped, " dropped because their page could not be downloaded")
+    print(len(unchecked), " dropped because their allmusic pages could not be downloaded")
+    print("requests: ", fe.get_scheduler().get_metrics())
+    fe.save_cache()
 
     ut.save_dict_json(artists_albums, file_name)
+    ut.save_dict_json(excluded, file_name + '.excluded')
+    if count_dropped == 0 and len(unchecked) == 0:
+        os.remove(checkpoint_file)
+    else:
+        print("run again with resume = True to retry the dropped artists")
     #print(artists_albums)
 
+# like get_and_save_artists_albums, but for several genre files in one crawl, without fetching the same page twice
+# artists that are in more than one genre file have their album page, allmusic check and artist page fetched only once,
+# and their albums are written to every genre file they belong to
+
+# the artist pages fetched are kept in frontier_file (json-lines, one record per artist page url), the crawl's seen-set
+# pages already in it are never fetched again, by this crawl or later ones (so remove the file to start a fresh crawl)
+# each genre file's left out artists are saved to its file_name + '.excluded', for update_artists_albums
+
+# params: genre_files - dictionary with keys = names of the .json files to save, values = list of genres for that file
+#         frontier_file - name of the seen-set file
+#         session, max_workers, streaming - see get_and_save_artists_albums
+
+def get_and_save_genres_artists_albums(genre_files, frontier_file, session = None, max_workers = 1, streaming = False):
+    # keys = artist page urls, values = list of albums on that page (or None if it could not be parsed)
+    seen = {}
+    if os.path.exists(frontier_file):
+        for record in ut.read_json_lines(frontier_file):
+            seen[record['url']] = record['albums']
+        print(len(seen), " artist pages already fetched in ", frontier_file)
+
+        # rewrite it without any partly written last record, so new records start on their own line
+        with open(frontier_file + '.tmp', 'w') as journal:
+            for artist_url, albums in seen.items():
+                journal.write(json.dumps({'url': artist_url, 'albums': albums}) + '\n')
+        os.replace(frontier_file + '.tmp', frontier_file)
+
+    # each artist's url is only looked up in the first genre file they're found in
+    known_artists = {}
+    file_artists = {}
+    file_unresolved = {}
+    for file_name, genres in genre_files.items():
+        file_unresolved[file_name] = set()
+        file_artists[file_name] = ut.get_artists_from_genres(genres, max_workers, session, streaming, known_artists, file_unresolved[file_name])
+        known_artists.update(file_artists[file_name])
+        print(len(file_artists[file_name]), " artists for ", file_name)
+
+    num_artist_entries = sum(len(artists) for artists in file_artists.values())
+    print(len(known_artists), " unique artists, out of ", num_artist_entries, " in all genre files")
+
+    all_artists = set(known_artists)
+    unchecked = ut.earliest_album_date_allmusic(known_artists, session, max_workers)
+    print(len(known_artists), " after considering earliest album date")
+    # left out of every genre file they're in, like in get_and_save_artists_albums (but not the unchecked ones, so an update will
+    # check them again)
+    excluded = all_artists - set(known_artists) - set(unchecked)
+
+    to_fetch = []
+    for artist_url in known_artists.values():
+        if artist_url not in seen:
+            to_fetch.append(artist_url)
+            seen[artist_url] = None # until it's fetched
+    print(len(to_fetch), " artist pages to fetch")
+
+    count_dropped = 0
+    dropped = set()
+    with open(frontier_file, 'a') as journal:
+        cur_url = 1
+        for artist_url in to_fetch:
+            print(cur_url, " of ", len(to_fetch))
+            cur_url += 1
+            try:
+                albums = ut.get_albums_from_artist_page(artist_url, session, streaming)
+            except fe.FetchError as e: # not in the seen-set file, so will be tried again next crawl
+                print(e)
+                count_dropped += 1
+                dropped.add(artist_url)
+                continue
+            seen[artist_url] = albums
+            ut.append_json_line({'url': artist_url, 'albums': albums}, journal)
+
+    print(count_dropped, " dropped because their page could not be downloaded")
+    print("requests: ", fe.get_scheduler().get_metrics())
+    fe.save_cache()
+
+    # each file's artists left out of it (not the ones whose page was dropped, so an update will try them again) are saved to
+    # file_name + '.excluded', like get_and_save_artists_albums does, for update_artists_albums
+    for file_name, artists in file_artists.items():
+        artists_albums = {}
+        file_excluded = set(file_unresolved[file_name])
+        for artist, artist_url in artists.items():
+            if artist in known_artists and seen.get(artist_url) is not None:
+                artists_albums[artist] = seen[artist_url]
+            elif artist in excluded or (artist in known_artists and artist_url not in dropped):
+                file_excluded.add(artist)
+        ut.save_dict_json(artists_albums, file_name)
+        ut.save_dict_json(sorted(file_excluded), file_name + '.excluded')
+
+# update a genre file saved by get_and_save_artists_albums with the releases since it was crawled, instead of crawling it again
+# browse pages are sorted by date, newest first, so only the first ones are read: up to the first page holding only known albums
+# an album is known if it's in file_name already (same artist and title), or is by an artist in file_name + '.excluded' (the ones left out
+# by an earlier crawl)
+# only the artists with new albums have their pages fetched again, and new artists must pass the same allmusic check as in a full crawl
+
+# params: genres - the genres file_name was crawled from
+#         file_name - the .json file to update
+#         session, streaming - see get_and_save_artists_albums
+
+def update_artists_albums(genres, file_name, session = None, streaming = False):
+    artists_albums = json_to_dict_artists_albums(file_name)
+    excluded_file = file_name + '.excluded'
+    excluded = set(json_to_dict_artists_albums(excluded_file)) if os.path.exists(excluded_file) else set()
+
+    known_albums = set()
+    for artist, albums in artists_albums.items():
+        for this_album in albums:
+            known_albums.add((artist, this_album[1]))
+
+    # keys = artists with new albums, values = album page urls of those albums
+    new_album_urls = {}
+    for g in genres:
+        last_page = ut.get_num_genre_pages(g, session, streaming)
+        for i in range(last_page):
+            num_new = 0
+            for artist, album_title, album_url in ut.get_genre_page_releases(g, i, session, streaming):
+                if artist not in excluded and (artist, album_title) not in known_albums:
+                    num_new += 1
+                    if artist not in new_album_urls:
+                        new_album_urls[artist] = []
+                    new_album_urls[artist].append(album_url)
+            print(g, " page ", i, ": ", num_new, " new albums")
+            if num_new == 0:
+                break
+
+    print(len(new_album_urls), " artists with new albums")
+
+    artists = {}
+    for artist, album_urls in new_album_urls.items():
+        failed = False
+        for album_url in album_urls:
+            try:
+                artist_url = ut.get_artist_url_from_album_page(album_url, session, streaming)
+            except fe.FetchError as e: # not excluded, so tried again next update
+                print(e)
+                failed = True
+                continue
+            if artist_url is not None:
+                artists[artist] = artist_url
+                break
+        # new artists without an artist page link are excluded, like in a full crawl (so their albums aren't new next update)
+        if artist not in artists and artist not in artists_albums and not failed:
+            excluded.add(artist)
+
+    new_artists = {artist: artist_url for artist, artist_url in artists.items() if artist not in artists_albums}
+    num_new_artists = len(new_artists)
+    unchecked = ut.earliest_album_date_allmusic(new_artists, session)
+    print(len(new_artists), " of ", num_new_artists, " new artists after considering earliest album date")
+    for artist in artists:
+        if artist not in artists_albums and artist not in new_artists and artist not in unchecked: # unchecked ones are new again next update
+            excluded.add(artist)
+
+    for artist, artist_url in artists.items():
+        if artist in artists_albums or artist in new_artists:
+            try:
+                this_artist_albums = ut.get_albums_from_artist_page(artist_url, session, streaming)
+            except fe.FetchError as e: # keeps the old albums, the new ones will be found again next update
+                print(e)
+                continue
+            if this_artist_albums != None:
+                artists_albums[artist] = this_artist_albums
+            elif artist in new_artists:
+                excluded.add(artist)
+
+    fe.save_cache()
+
+    ut.save_dict_json(artists_albums, file_name)
+    ut.save_dict_json(sorted(excluded), excluded_file)
+
 def erroneous_scores(artists_albums):
     max_score = [0,""]
     min_score = [100,""]
@@ -148,8 +423,83 @@ def json_to_dict_artists_albums(filename):
     with open(filename) as tf:
         return json.load(tf)
 
+# get the (artist, albums) pairs of a genre file one at a time
+# a .jsonl file (see utilities.save_dict_json_lines) is read a line at a time, and a directory is read as a sharded store (see
+# utilities.save_dict_json_shards), a line at a time shard by shard (each artist once, with their last appended albums), so neither is
+# ever loaded whole. a .json file is only streamed if the optional ijson package is installed: otherwise it is loaded whole with json.load,
+# like json_to_dict_artists_albums, with a warning (save it with utilities.save_dict_json_lines to stream it without ijson)
+# param: filename (of the .json or .jsonl, or the directory)
+# yields: (artist, albums) tuples, in the order they are in the file
+def iter_artists_albums(filename):
+    if os.path.isdir(filename):
+        yield from ut.iter_json_shards(filename)
+        return
+    with open(filename, 'rb') as tf:
+        if filename.endswith('.jsonl'):
+            for line in tf:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['artist'], record['albums']
+        elif ijson is not None:
+            yield from ijson.kvitems(tf, '')
+        else:
+            warnings.warn("ijson is not installed, so " + filename + " is loaded whole instead of streamed", stacklevel = 2)
+            yield from json.load(tf).items()
+
+# field_preprocessing for a stream of (artist, albums) pairs, ie from iter_artists_albums, so the whole corpus is never in memory
+# the dates of batch_size artists at a time are parsed together
+# params: pairs - iterable of (artist, albums) tuples, as scraped
+#         batch_size - number of artists to parse dates for at once
+# yields: (artist, albums) tuples, with the albums the same as field_preprocessing would leave them (artists without albums left are skipped)
+def iter_preprocessed(pairs, batch_size = 1000):
+    pairs = iter(pairs)
+    while True:
+        batch = list(islice(pairs, batch_size))
+        if len(batch) == 0:
+            return
+
+        dates = album_datetimes([this_album[2] for artist, albums in batch for this_album in albums])
+        cur_date = 0
+        for artist, albums in batch:
+            kept_albums = preprocess_albums(albums, dates[cur_date:cur_date + len(albums)])
+            cur_date += len(albums)
+            if len(kept_albums) > 0:
+                yield artist, kept_albums
+
+# get the AlbumTable (columnar form of artists_albums, see album_store.py) for a genre .json file, after field_preprocessing
+# the file is read with iter_artists_albums, so for a .jsonl file or sharded store (or a .json file, if ijson is installed) only the
+# table is ever held in memory
+# params: filename (of the .json or .jsonl, or a sharded store directory)
+# returns: AlbumTable
+def json_to_album_table(filename):
+    return als.AlbumTable.from_pairs(iter_preprocessed(iter_artists_albums(filename)))
+
+# same as json_to_album_table, for the union (see dictionary_union) of one or more genre .json files, cached on disk
+# the first call saves the table to cache_dir (see album_store.save_album_table), and later ones just open it from there
+# the cached table is rebuilt automatically if any of the .json files change
+# params: filenames - a .json file name, or a list of them
+#         cache_dir - directory for the cached table
+#         max_workers - number of processes to preprocess the .json files with, when the table is built (see preprocess_all)
+# returns: AlbumTable
+def cached_album_table(filenames, cache_dir, max_workers = None):
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    source_hash = als.files_hash(filenames)
+    table = als.load_album_table(cache_dir, source_hash)
+    if table is not None:
+        return table
+
+    print("building album table for ", filenames)
+    artists_albums, _ = preprocess_all(filenames, max_workers)
+    table = als.AlbumTable.from_artists_albums(artists_albums)
+
+    als.save_album_table(table, cache_dir, source_hash)
+    saved_table = als.load_album_table(cache_dir, source_hash)
+    return saved_table if saved_table is not None else table # another process can have replaced the build in between
+
 # for determining album order for a given artist
-# helper function for field_preprocessing, below
+# for a single date... field_preprocessing parses all dates at once with parse_metacritic_dates, below
 # converts metacritic date string into a sortable date object
 # param: date string from metacritic
 # returns: sortable date object
@@ -166,103 +516,163 @@ def date_formatting(full_date):
     #print(newd)
     return dt.strptime(newd, '%b %d %Y')
 
+# month abbreviations (sorted, for searchsorted) and their month numbers (from 0), for parse_metacritic_dates
+MONTH_NAMES = np.array(['Apr', 'Aug', 'Dec', 'Feb', 'Jan', 'Jul', 'Jun', 'Mar', 'May', 'Nov', 'Oct', 'Sep'])
+MONTH_NUMBERS = np.array([3, 7, 11, 1, 0, 6, 5, 2, 4, 10, 9, 8])
+
+# date_formatting for many dates at once, using numpy string and date arithmetic instead of a strptime per date
+# param: date_strings - list (or array) of metacritic date strings, like 'Apr 14, 2015'
+# returns: (dates, malformed) - a datetime64[D] array of the dates (NaT where a string couldn't be parsed),
+#          and the list of indexes of the strings that couldn't be parsed
+def parse_metacritic_dates(date_strings):
+    date_strings = np.char.strip(np.asarray(date_strings, dtype = str))
+    if len(date_strings) == 0:
+        return np.array([], dtype = 'datetime64[D]'), []
+
+    month_names, _, rest = np.char.partition(date_strings, ' ').T
+    days, _, years = np.char.partition(rest, ',').T
+    month_names = np.char.capitalize(month_names)
+    days = np.char.strip(days)
+    years = np.char.strip(years)
+
+    month_pos = np.minimum(np.searchsorted(MONTH_NAMES, month_names), len(MONTH_NAMES) - 1)
+    valid = ((MONTH_NAMES[month_pos] == month_names) & np.char.isdigit(days) & (np.char.str_len(days) <= 2)
+             & np.char.isdigit(years) & (np.char.str_len(years) == 4))
+
+    # parse only the valid ones, the rest are set to 1 January 1970 and then NaT
+    day_numbers = np.where(valid, days, '1').astype(np.int64)
+    year_numbers = np.where(valid, years, '1970').astype(np.int64)
+    months = (year_numbers - 1970) * 12 + MONTH_NUMBERS[month_pos]
+    first_of_month = months.astype('datetime64[M]')
+    dates = first_of_month.astype('datetime64[D]') + (day_numbers - 1)
+
+    # days past the end of their month (or 0) roll into another month
+    valid &= (day_numbers >= 1) & (dates.astype('datetime64[M]') == first_of_month)
+    dates[~valid] = np.datetime64('NaT')
+
+    return dates, np.flatnonzero(~valid).tolist()
+
+# param: date_strings - list of metacritic date strings
+# returns: array of datetime.datetime objects (same as date_formatting), parsed with parse_metacritic_dates
+# raises: ValueError listing every malformed date, if there are any
+def album_datetimes(date_strings):
+    dates, malformed = parse_metacritic_dates(date_strings)
+    if len(malformed) > 0:
+        raise ValueError(str(len(malformed)) + " malformed album dates: " + ", ".join(repr(date_strings[i]) for i in malformed))
+    return dates.astype('datetime64[us]').astype(object)
+
+# helper for field_preprocessing, below: does all of its steps for one artist's albums, in a single pass over them
+# params: albums - the artist's list of albums (lists)
+#         dates - the sortable dates of those albums, in the same order (see parse_metacritic_dates)
+# returns: new list of the albums for which this artist is a "Primary Artist", each with its scores converted and its date appended,
+#          sorted by date
+def preprocess_albums(albums, dates):
+    kept_albums = []
+    for this_album, this_date in zip(albums, dates):
+        # review scores formatting
+        # note: if either is "tbd" (Metacritic has these values) the album is kept, with the "tbd" left as is
+        try:
+            this_album[0] = int(this_album[0])
+        except (ValueError, TypeError):
+            pass
+        try:
+            this_album[4] = int(float(this_album[4]) * 10) # from 10-pt scale w decimals to 100-pt scale
+        except (ValueError, TypeError):
+            pass
+
+        # date formatting
+        this_album.append(this_date)
+
+        # remove albums for which this artist is not a "Primary Artist"
+        if this_album[3].find("Primary Artist") != -1:
+            kept_albums.append(this_album)
+
+    kept_albums.sort(key = lambda this_album : this_album[5])
+    return kept_albums
+
 # 1) sortable dates (from the string Metacritic provides) to each album of each artist
 # 2) convert user score and critic score for each album to ints (from strings)
 # 3) convert user score to be on a 100-point (instead of 10-point) scale, to match critic score
 # 4) remove any albums for which this artist is not a "Primary Artist" (Metacritic lingo)
+# 5) sort each artist's albums by date, and remove artists left without any albums
 
 # param: artists_albums - dictionary with keys = artist name, and values = list of lists, where
 # each sublist is an album
 
 def field_preprocessing(artists_albums):
-    #print("Preprocessing fields...")
-    #print("artist_albums length: ", len(artists_albums))
-
-    removed_new_l2 = 0
-    removed_all_tbd = 0
-    removed_albums = 0
-
-    #for io progress tracking
-    num_artists = len(artists_albums)
-    cur_artist = 0
-
-    # if artist has any album that has no rating for both the user score and the critic score, then the artist will need to be removed entirely
-    artists_to_remove = set()
+    # parse the dates of all albums at once, so any malformed ones are reported together, before anything is changed
+    dates = album_datetimes([this_album[2] for albums in artists_albums.values() for this_album in albums])
 
+    artists_to_remove = []
+    cur_date = 0
     for artist, albums in artists_albums.items():
-        #print(cur_artist, " out of ", num_artists)
-        #print("Current artist: ", artist)
-        cur_artist += 1 # for io progress tracking ONYL... can be deleted
-
-        #if len(albums) <= 1: # if only one album, this artist cant be compared for which album in its career was highest rated
-        if len(albums) <= 0: #  no longer need this... hacky way to remove it but its fine
-            artists_to_remove.add(artist)
-            #print("artist: ", artist, " being removed since only has 1 album")
-        else:
-            albums_to_remove = []
-            for this_album in albums:
-                # review scores formatting
-                # note: if either is "tbd" (Metacritic has these values) then we do not want to remove the album -- and therefore the whole artist, yet
-                # however, if both are "tbd," then we would have to remove the whole artist
-                all_tbd = 0
-
-                try:
-                    this_album[0] = int(this_album[0])
-                except:
-                    all_tbd += 1
-                try:
-                    this_album[4] = int(float(this_album[4]) * 10) # from 10-pt scale w decimals to 100-pt scale
-                except:
-                    all_tbd += 1
-
-                ''' # no longer removing artists that have an album where both user score and critic's score is 'tbd'
-                if all_tbd == 2: # need to remove the whole artist, since both user score and critic score are 'tbd' for a given album
-                    artists_to_remove.add(artist)
-                    removed_all_tbd += 1
-                    #print("artist: ", artist, " being removed since tbd for ", this_album)
-                    break # leaves the for loop iterating through the rest of this artist's albums, since the artist will be removed
-                '''
+        kept_albums = preprocess_albums(albums, dates[cur_date:cur_date + len(albums)])
+        cur_date += len(albums)
 
-                # date formatting
-                formatted_date = date_formatting(this_album[2])
-                this_album.append(formatted_date)
-
-                # remove albums for which this artist is not a "Primary Artist"
-                if this_album[3].find("Primary Artist") == -1:
-                    albums_to_remove.append(this_album)
-                    #print("Album: ", this_album[1], " removed from artist: ", artist, " since artist was not a Primary Artist")
-
-
-            # now that all albums for this artist have had the sortable date added to them, sort them
-            # except if user score and reviewer score (all_tbd == 2) were not populated... then removing artist so no need to sort, etc
-
-            # if all_tbd != 2:
-            # no longer removing artists that have an album where both user and critic score is tbd
-
-            # for tracking only...
-            removed_albums += len(albums_to_remove)
-            #print(albums_to_remove)
-
-            albums = [this_album for this_album in albums if this_album not in albums_to_remove]
-            # now need to re-check that none have 0 albums
-
-            if len(albums) <= 0:
-                artists_to_remove.add(artist)
-                removed_new_l2 += 1
-            else:
-                artists_albums[artist] = albums
-                artists_albums[artist].sort(key = lambda this_album : this_album[5])
+        if len(kept_albums) <= 0:
+            artists_to_remove.append(artist)
+        else:
+            artists_albums[artist] = kept_albums
 
     for artist in artists_to_remove:
-        #print("removing", artist)
         del artists_albums[artist]
 
-    #print("removed_new_l2: ", removed_new_l2)
-    #print("removed_all_tbd: ", removed_all_tbd)
-    #print("albums to remove cumulative: ", removed_albums)
-    #print("artist_albums length: ", len(artists_albums))
-    #print(artists_albums)
 
+# replace the album lists of artists_albums (after field_preprocessing) with compact Album records (see album_store.py)
+# param: artists_albums - the usual dictionary, changed in place
+def albums_to_records(artists_albums):
+    for artist, albums in artists_albums.items():
+        artists_albums[artist] = [als.Album.from_list(this_album) for this_album in albums]
+
+# loads a genre file (or one shard of a sharded store) and runs it through field_preprocessing, for preprocess_all
+# param: source - genre file name, or (directory, shard index) of a sharded store
+# returns: (artists_albums, seconds loading, seconds in field_preprocessing)
+def load_and_preprocess(source):
+    start = time.perf_counter()
+    if isinstance(source, tuple):
+        artists_albums = ut.read_dict_json_shards_part(source[0], [source[1]])
+    else:
+        artists_albums = json_to_dict_artists_albums(source)
+    loaded = time.perf_counter()
+    field_preprocessing(artists_albums)
+    return artists_albums, loaded - start, time.perf_counter() - loaded
+
+# load and field_preprocessing every genre file, in a pool of processes, and merge them into one dictionary
+# params: sources - genre .json file names, and/or directories of sharded stores (each shard of which is preprocessed separately)
+#         max_workers - number of processes, defaults to one per cpu (1 does everything in this process)
+# returns: (artists_albums, timings)
+#          artists_albums - union of the preprocessed genres, same as dictionary_union of them (in the order of sources)
+#          timings - dictionary of seconds: 'load' and 'preprocess' summed over all the sources (ie cpu time in the workers),
+#                    'workers' (from starting the pool until the last source is back), 'merge', and 'total'
+def preprocess_all(sources, max_workers = None):
+    start = time.perf_counter()
+    parts = []
+    for source in sources:
+        if os.path.isdir(source):
+            parts.extend((source, i) for i in range(ut.read_shards_index(source)['num_shards']))
+        else:
+            parts.append(source)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(parts))
+    if max_workers <= 1:
+        results = [load_and_preprocess(part) for part in parts]
+    else:
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+            results = list(executor.map(load_and_preprocess, parts))
+    workers_done = time.perf_counter()
+
+    # same as dictionary_union, without copying the first part (they are all fresh dictionaries from the workers)
+    artists_albums = {}
+    for part_albums, _, _ in results:
+        artists_albums.update(part_albums)
+    end = time.perf_counter()
+
+    timings = {'load': sum(result[1] for result in results), 'preprocess': sum(result[2] for result in results),
+               'workers': workers_done - start, 'merge': end - workers_done, 'total': end - start}
+    print("preprocessed ", len(parts), " parts with ", max_workers, " workers: ", ", ".join(stage + " %.3fs" % seconds for stage, seconds in timings.items()))
+    return artists_albums, timings
 
 # creates a sample artists_albums dictionary to use from a portion of a dictionary from one of the genre files (that hold json dictionaries already)
 # param: from_file_name - the existing json file to use
@@ -1,128 +1,612 @@
-import requests
-from lxml import html
+from lxml import html, etree
 from urllib.parse import quote
 import json
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+import fetching as fe
 
 # save dict to json file
 # params: artists_albums - dictionary of keys = artist name, values = list of lists of album values
 #         file_name - should end with .json
-def save_dict_json(artists_albums, file_name):
+#         num_shards - if given, file_name is instead a directory to save artists_albums to as that many json-lines shards (see save_dict_json_shards)
+def save_dict_json(artists_albums, file_name, num_shards = None):
+    if num_shards is not None:
+        save_dict_json_shards(artists_albums, file_name, num_shards)
+        return
     print("saving dictionary as ", file_name)
     with open(file_name,'w') as save_to:
         json.dump(artists_albums, save_to)
 
+# save artists_albums as a json-lines file, one {"artist": ..., "albums": [...]} record per line, so it can be read (or written) an
+# artist at a time (see preprocessing.iter_artists_albums)
+# params: artists_albums - dictionary of keys = artist name, values = list of lists of album values, or an iterable of (artist, albums) pairs
+#         file_name - should end with .jsonl
+def save_dict_json_lines(artists_albums, file_name):
+    print("saving dictionary as ", file_name)
+    if isinstance(artists_albums, dict):
+        artists_albums = artists_albums.items()
+    with open(file_name, 'w') as save_to:
+        for artist, albums in artists_albums:
+            save_to.write(json.dumps({'artist': artist, 'albums': albums}) + '\n')
+
+# sharded json-lines store
+# a directory of num_shards json-lines files (records as in save_dict_json_lines), each artist in the shard given by a hash of its name,
+# and index.json, listing the shards with how many records and bytes each has. index.json is replaced (atomically) after the shards are
+# written, and readers only read as many bytes of each shard as it says, so a reader never sees a half written append. appending only
+# adds lines to the end of the shards, an artist appended again is a new record, and the last record of an artist is the one that counts
+# there should only be one writer at a time, any number of readers (ie a process per shard, see read_dict_json_shards)
+
+SHARDS_FORMAT_VERSION = 1
+
+# params: artist - artist name
+#         num_shards
+# returns: the shard the artist goes in (crc32 of the name, so the same in every process and run, unlike hash())
+def shard_of(artist, num_shards):
+    return zlib.crc32(artist.encode('utf-8')) % num_shards
+
+# param: directory - of a sharded store
+# returns: the store's index (dictionary with 'version', 'num_shards', and 'shards': list of dictionaries with 'file', 'records', 'bytes')
+def read_shards_index(directory):
+    with open(os.path.join(directory, 'index.json')) as f:
+        index = json.load(f)
+    if index.get('version') != SHARDS_FORMAT_VERSION:
+        raise ValueError("unsupported shards index version in " + directory + ": " + str(index.get('version')))
+    return index
+
+def write_shards_index(index, directory):
+    index_file = os.path.join(directory, 'index.json')
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(index_file + '.tmp', index_file)
+
+# save artists_albums as a sharded store, replacing any store already in directory
+# params: artists_albums - dictionary of keys = artist name, values = list of lists of album values, or an iterable of (artist, albums) pairs
+#         directory - created if needed
+#         num_shards
+def save_dict_json_shards(artists_albums, directory, num_shards = 8):
+    print("saving dictionary as ", directory, "(" + str(num_shards) + " shards)")
+    os.makedirs(directory, exist_ok = True)
+    index = {'version': SHARDS_FORMAT_VERSION, 'num_shards': num_shards,
+             'shards': [{'file': 'shard-' + str(i).zfill(5) + '.jsonl', 'records': 0, 'bytes': 0} for i in range(num_shards)]}
+    for shard in index['shards']: # empty shards, so an interrupted save doesn't leave records of an older store behind
+        open(os.path.join(directory, shard['file']), 'wb').close()
+    write_shards_index(index, directory)
+    append_dict_json_shards(artists_albums, directory)
+
+# add artists to a sharded store, without rewriting what is already in it
+# params: artists_albums - dictionary of keys = artist name, values = list of lists of album values, or an iterable of (artist, albums) pairs
+#         directory - of a sharded store (see save_dict_json_shards)
+def append_dict_json_shards(artists_albums, directory):
+    index = read_shards_index(directory)
+    if isinstance(artists_albums, dict):
+        artists_albums = artists_albums.items()
+
+    shard_files = [open(os.path.join(directory, shard['file']), 'ab') for shard in index['shards']]
+    try:
+        for shard, shard_file in zip(index['shards'], shard_files):
+            shard_file.seek(0, os.SEEK_END)
+            shard_file.truncate(shard['bytes']) # drops the end of an append that never made it into the index
+        for artist, albums in artists_albums:
+            i = shard_of(artist, index['num_shards'])
+            line = (json.dumps({'artist': artist, 'albums': albums}) + '\n').encode('utf-8')
+            shard_files[i].write(line)
+            index['shards'][i]['records'] += 1
+            index['shards'][i]['bytes'] += len(line)
+        for shard_file in shard_files:
+            shard_file.flush()
+            os.fsync(shard_file.fileno())
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+    write_shards_index(index, directory)
+
+# params: path - of a shard
+#         num_bytes - how many bytes of it to read (from the store's index)
+# yields: the shard's records, as lines (bytes), read one at a time
+def iter_shard_lines(path, num_bytes):
+    with open(path, 'rb') as f:
+        for line in f:
+            num_bytes -= len(line)
+            if num_bytes < 0: # the start of an append that never made it into the index
+                return
+            yield line
+            if num_bytes == 0:
+                return
+
+# records are written by json.dumps({'artist': ..., 'albums': ...}), so the artist's name can be read without parsing the albums
+RECORD_ARTIST_PREFIX = b'{"artist": '
+JSON_DECODER = json.JSONDecoder()
+
+# param: line - a record of a shard
+# returns: the record's artist
+def record_artist(line):
+    if line.startswith(RECORD_ARTIST_PREFIX):
+        return JSON_DECODER.raw_decode(line[len(RECORD_ARTIST_PREFIX):].decode('utf-8'))[0]
+    return json.loads(line)['artist']
+
+# params: directory - of a sharded store
+#         shards - indexes of the shards to read, defaults to all of them
+#         index - the store's index, if already read
+# yields: (artist, albums) tuples of the shards, each artist once, with its last record (an artist appended again is yielded where its
+#         last record is). each shard is read twice, a line at a time: first only for the artists' names, to find their last records
+def iter_json_shards(directory, shards = None, index = None):
+    if index is None:
+        index = read_shards_index(directory)
+    if shards is None:
+        shards = range(index['num_shards'])
+    for i in shards:
+        shard = index['shards'][i]
+        path = os.path.join(directory, shard['file'])
+        last_record = {record_artist(line): n for n, line in enumerate(iter_shard_lines(path, shard['bytes']))}
+        for n, line in enumerate(iter_shard_lines(path, shard['bytes'])):
+            record = json.loads(line)
+            if last_record[record['artist']] == n:
+                yield record['artist'], record['albums']
+
+# params: directory - of a sharded store
+#         shards - indexes of the shards to read
+# returns: artists_albums dictionary of the artists in those shards
+def read_dict_json_shards_part(directory, shards):
+    return dict(iter_json_shards(directory, shards))
+
+# read a whole sharded store back into an artists_albums dictionary, the shards split between max_workers processes
+# params: directory - of a sharded store
+#         max_workers - number of processes (1 reads every shard in this process)
+# returns: artists_albums dictionary, artists in shard order
+def read_dict_json_shards(directory, max_workers = 1):
+    index = read_shards_index(directory)
+    if max_workers <= 1:
+        return dict(iter_json_shards(directory, index = index))
+
+    artists_albums = {}
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        parts = executor.map(read_dict_json_shards_part, [directory] * index['num_shards'], [[i] for i in range(index['num_shards'])])
+        for part in parts:
+            artists_albums.update(part)
+    return artists_albums
+
+# append one record to a json-lines file (ie a crawl checkpoint journal), and make sure it is on disk before returning
+# params: record - anything json serializable
+#         journal - a file object opened for appending
+def append_json_line(record, journal):
+    journal.write(json.dumps(record) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+# param: file_name - a json-lines file, one json record per line
+# returns: list of the records in the file. a partly written last line (ie from a crash mid-write) is skipped
+def read_json_lines(file_name):
+    records = []
+    with open(file_name) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                if line.endswith('\n'): # only the last line can be cut short
+                    raise
+    return records
+
+# base urls for all metacritic and allmusic requests (can be pointed at local mirrors of their pages)
+METACRITIC_URL = 'http://www.metacritic.com'
+ALLMUSIC_URL = 'http://www.allmusic.com'
+
+# streaming html parsing
+# instead of building the tree of a whole page from its whole body, the page is parsed as its chunks are downloaded, and every element
+# is thrown away as soon as it ends, unless it is inside a "container" element that something is extracted from. so only a few small
+# elements are held in memory at a time, however big the page is
+
+# same as contains(@class, class_name) in an xpath
+def has_class(element, class_name):
+    return class_name in (element.get('class') or '')
+
+# params: chunks - iterator over the html of a page (bytes), ie from fetching.iter_content
+#         extractors - dictionary with keys = names, values = (is_container, extract) tuples, where is_container is a function of an element
+#                      that is true for the elements to extract from, and extract is a function of such an element returning a list
+# returns: dictionary with the same keys, values = everything extracted from the matching containers, in page order
+def stream_extract(chunks, extractors):
+    results = {name: [] for name in extractors}
+    parser = etree.HTMLPullParser(events = ('end',))
+
+    def handle_events():
+        for event, element in parser.read_events():
+            if any(is_container(ancestor) for ancestor in element.iterancestors() for is_container, extract in extractors.values()):
+                continue # cleared along with its container
+
+            for name, (is_container, extract) in extractors.items():
+                if is_container(element):
+                    results[name].extend(extract(element))
+
+            element.clear(keep_tail = True)
+            # the root's previous siblings are top-level comments or processing instructions, which can't be deleted (nor need to be)
+            if element.getparent() is not None:
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+    empty = True
+    for chunk in chunks:
+        empty = empty and len(chunk) == 0
+        parser.feed(chunk)
+        handle_events()
+    if empty: # same as html.fromstring
+        raise etree.ParserError("Document is empty")
+    parser.close()
+    handle_events()
+
+    return results
+
+def is_product_artist_item(element):
+    return element.tag == 'li' and has_class(element, 'product_artist')
+
+def is_product_title_div(element):
+    return element.tag == 'div' and has_class(element, 'product_title')
+
+def is_last_page_item(element):
+    return element.tag == 'li' and has_class(element, 'last_page')
+
+def is_product_artist_div(element):
+    return element.tag == 'div' and has_class(element, 'product_artist')
+
+# a row of the release table on an artist page, ie //table[contains(@class, 'credits')]/tbody/tr
+def is_album_row(element):
+    if element.tag != 'tr':
+        return False
+    tbody = element.getparent()
+    if tbody is None or tbody.tag != 'tbody':
+        return False
+    table = tbody.getparent()
+    return table is not None and table.tag == 'table' and has_class(table, 'credits')
+
+# all the text of an element, child elements' included (ie a title with <em> markup in it)
+ELEMENT_STRING = etree.XPath("string()", smart_strings = False)
+
+# param: div - a product_title div on a browse page
+# returns: list of (album page url, album title) tuples, one per link in the div (the same links as a/@href), so urls and titles never
+#          get out of step, even for titles split into several text nodes by markup, or links without any text
+def product_title_releases(div):
+    return [(a.get('href'), ELEMENT_STRING(a).strip()) for a in div.iterchildren('a') if a.get('href') is not None]
+
+# what to extract from each kind of page when streaming (the same nodes the xpaths in the functions below select)
+# smart_strings = False so the extracted strings don't keep the thrown away elements alive
+BROWSE_PAGE_EXTRACTORS = {'artists': (is_product_artist_item, etree.XPath("span[@class='data']/text()", smart_strings = False)),
+                          'album_urls': (is_product_title_div, etree.XPath("a/@href", smart_strings = False)),
+                          'album_releases': (is_product_title_div, lambda div : product_title_releases(div)),
+                          'last_page': (is_last_page_item, etree.XPath("a[@class='page_num']/text()", smart_strings = False))}
+ALBUM_PAGE_EXTRACTORS = {'artist_urls': (is_product_artist_div, etree.XPath("a/@href", smart_strings = False))}
+ARTIST_PAGE_EXTRACTORS = {'albums': (is_album_row, lambda row : [parse_album_row(row)])}
+
 # param: genres - a list of genres viewable on http://www.metacritic.com/music under browse by genre
+#        max_workers - number of pages to fetch at once. if more than 1, the crawl is done by get_artists_from_genres_concurrent
+#        session - requests session to use, defaults to the shared session from fetching.py
+#        streaming - parse pages as they download, keeping only the needed elements in memory (see stream_extract)
+#        known_artists - dictionary of artist names and urls already found (ie by a crawl of other genres). their album pages are not fetched again
+#        unresolved - if given, a set to which the artists none of whose album pages link to an artist page are added (artists with an album
+#                     page that could not be downloaded are not, since it might have had the link)
 # returns: artists - a dictionary of unique artist names (keys) and their metacritic artist page urls (values) for the combined genres
 
-def get_artists_from_genres(genres):
+def get_artists_from_genres(genres, max_workers = 1, session = None, streaming = False, known_artists = None, unresolved = None):
+    if max_workers > 1:
+        return get_artists_from_genres_concurrent(genres, max_workers, session, streaming, known_artists, unresolved)
+    if known_artists is None:
+        known_artists = {}
+
     print("getting artists from genres...")
 
     artists = {}
+    no_link = set()
+    failed = set()
 
     for g in genres:
         print(g)
-        # get number of pages
-        page = requests.get('http://www.metacritic.com/browse/albums/genre/date/' + g, headers={'User-Agent': 'Mozilla/5.0'})
-        tree = html.fromstring(page.content)
-        last_page = int(tree.xpath("//li[contains(@class, 'last_page')]/a[@class='page_num']/text()")[0])
+        last_page = get_num_genre_pages(g, session, streaming)
 
         # loop over all pages from 1 to last_page, and get artists (and artist pages on metacritic)
         for i in range(last_page):
             #print(i + 1, " out of ", last_page, " pages of artists")
-            page = requests.get('http://www.metacritic.com/browse/albums/genre/date/' + g + '?page=' + str(i), headers={'User-Agent': 'Mozilla/5.0'})
-            tree = html.fromstring(page.content)
+            for artist, album_url in get_genre_page_albums(g, i, session, streaming):
+                if artist in known_artists:
+                    artists[artist] = known_artists[artist]
+                elif artist not in artists:
+                    print(artist)
+                    try:
+                        artist_url = get_artist_url_from_album_page(album_url, session, streaming)
+                    except fe.FetchError as e: # the artist's next album is tried, if they have one
+                        print(e)
+                        failed.add(artist)
+                        continue
+                    if artist_url is not None:
+                        artists[artist] = artist_url
+                    else:
+                        no_link.add(artist)
+
+    if unresolved is not None:
+        unresolved.update(artist for artist in no_link if artist not in artists and artist not in failed)
+    return artists
 
-            some_artists = tree.xpath("//li[contains(@class, 'product_artist')]/span[@class='data']/text()")
-            some_artists_urls = tree.xpath("//div[contains(@class, 'product_title')]/a/@href")
+# helpers for get_artists_from_genres (and get_artists_from_genres_concurrent, below). each fetches and parses a single page
+
+# param: g - a metacritic genre
+# returns: the number of browse pages for that genre
+def get_num_genre_pages(g, session = None, streaming = False):
+    if streaming:
+        chunks = fe.iter_content(METACRITIC_URL + '/browse/albums/genre/date/' + g, session)
+        return int(stream_extract(chunks, BROWSE_PAGE_EXTRACTORS)['last_page'][0])
+
+    page = fe.get(METACRITIC_URL + '/browse/albums/genre/date/' + g, session)
+    tree = html.fromstring(page.content)
+    return int(tree.xpath("//li[contains(@class, 'last_page')]/a[@class='page_num']/text()")[0])
+
+# params: g - a metacritic genre
+#         i - the browse page number (from 0)
+# returns: list of (artist name, album page url) tuples, in the order they are listed on that page
+def get_genre_page_albums(g, i, session = None, streaming = False):
+    if streaming:
+        chunks = fe.iter_content(METACRITIC_URL + '/browse/albums/genre/date/' + g + '?page=' + str(i), session)
+        extracted = stream_extract(chunks, BROWSE_PAGE_EXTRACTORS)
+        return list(zip(extracted['artists'], extracted['album_urls']))
+
+    page = fe.get(METACRITIC_URL + '/browse/albums/genre/date/' + g + '?page=' + str(i), session)
+    tree = html.fromstring(page.content)
+
+    some_artists = tree.xpath("//li[contains(@class, 'product_artist')]/span[@class='data']/text()")
+    some_artists_urls = tree.xpath("//div[contains(@class, 'product_title')]/a/@href")
+
+    return list(zip(some_artists, some_artists_urls))
+
+# same as get_genre_page_albums, but with album titles (taken link by link, see product_title_releases)
+# returns: list of (artist name, album title, album page url) tuples, in the order they are listed on that page
+def get_genre_page_releases(g, i, session = None, streaming = False):
+    if streaming:
+        chunks = fe.iter_content(METACRITIC_URL + '/browse/albums/genre/date/' + g + '?page=' + str(i), session)
+        releases = stream_extract(chunks, BROWSE_PAGE_EXTRACTORS)
+        some_artists = releases['artists']
+        some_releases = releases['album_releases']
+    else:
+        page = fe.get(METACRITIC_URL + '/browse/albums/genre/date/' + g + '?page=' + str(i), session)
+        tree = html.fromstring(page.content)
 
-            count = 0
-            for this_url in some_artists_urls:
-                if some_artists[count] not in artists:
-                    print(some_artists[count])
-                    try:
-                        album_page = requests.get('http://www.metacritic.com' + this_url, headers={'User-Agent': 'Mozilla/5.0'})
-                        album_tree = html.fromstring(album_page.content)
+        some_artists = tree.xpath("//li[contains(@class, 'product_artist')]/span[@class='data']/text()")
+        some_releases = [release for div in tree.xpath("//div[contains(@class, 'product_title')]") for release in product_title_releases(div)]
 
-                        artist_url = album_tree.xpath("//div[contains(@class, 'product_artist')]/a/@href")[0]
-                        artists[some_artists[count]] = artist_url
-                    except: # The Script did not have a url link on their own page... causing artist_url list to be empty
-                        pass
-                count += 1
+    return [(artist, album_title, album_url) for artist, (album_url, album_title) in zip(some_artists, some_releases)]
 
-    return artists
+# param: album_url - the url of an album page, relative to METACRITIC_URL
+# returns: the url of the album's artist page, or None if the album page does not link to one
+# raises: fetching.FetchError if the album page could not be downloaded
+def get_artist_url_from_album_page(album_url, session = None, streaming = False):
+    try:
+        if streaming:
+            return stream_extract(fe.iter_content(METACRITIC_URL + album_url, session), ALBUM_PAGE_EXTRACTORS)['artist_urls'][0]
+
+        album_page = fe.get(METACRITIC_URL + album_url, session)
+        album_tree = html.fromstring(album_page.content)
 
+        return album_tree.xpath("//div[contains(@class, 'product_artist')]/a/@href")[0]
+    except fe.FetchError:
+        raise
+    except: # The Script did not have a url link on their own page... causing artist_url list to be empty
+        return None
 
+# same as get_artists_from_genres, but fetches up to max_workers pages at a time
+# all browse pages of all genres are fetched at once, then the album page of every artist found on them
+# if an artist's album page has no artist url, their next album (in browse order) is tried, like the sequential crawl does
+# params: genres - a list of genres viewable on http://www.metacritic.com/music under browse by genre
+#         max_workers - the maximum number of requests in flight at any time (the session's pool_maxsize should be at least this)
+#         session - requests session to use, defaults to the shared session from fetching.py
+#         streaming, known_artists, unresolved - see get_artists_from_genres
+# returns: the same dictionary as get_artists_from_genres
+
+def get_artists_from_genres_concurrent(genres, max_workers = 8, session = None, streaming = False, known_artists = None, unresolved = None):
+    print("getting artists from genres (", max_workers, " at a time)...")
+    if known_artists is None:
+        known_artists = {}
+
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        last_pages = list(pool.map(partial(get_num_genre_pages, session = session, streaming = streaming), genres))
+
+        page_genres = []
+        page_nums = []
+        for g, last_page in zip(genres, last_pages):
+            for i in range(last_page):
+                page_genres.append(g)
+                page_nums.append(i)
+
+        # album page urls for each artist, in the order the sequential crawl would visit them
+        album_urls = {}
+        for page_albums in pool.map(partial(get_genre_page_albums, session = session, streaming = streaming), page_genres, page_nums):
+            for artist, album_url in page_albums:
+                if artist not in album_urls:
+                    album_urls[artist] = []
+                album_urls[artist].append(album_url)
+        print(len(album_urls), " artists found on ", len(page_nums), " pages")
+
+        # the artist url of an album page, or the FetchError if it could not be downloaded
+        def try_artist_url(album_url):
+            try:
+                return get_artist_url_from_album_page(album_url, session, streaming)
+            except fe.FetchError as e:
+                print(e)
+                return e
+
+        # keys = artists still without an artist url, values = position of the album page to try next
+        artists_found = {artist: known_artists[artist] for artist in album_urls if artist in known_artists}
+        to_try = {artist: 0 for artist in album_urls if artist not in known_artists}
+        failed = set()
+        while len(to_try) > 0:
+            urls = [album_urls[artist][i] for artist, i in to_try.items()]
+            next_to_try = {}
+            for (artist, i), artist_url in zip(to_try.items(), pool.map(try_artist_url, urls)):
+                if isinstance(artist_url, fe.FetchError):
+                    failed.add(artist)
+                    artist_url = None
+                if artist_url is not None:
+                    artists_found[artist] = artist_url
+                elif i + 1 < len(album_urls[artist]):
+                    next_to_try[artist] = i + 1
+                elif artist not in failed and unresolved is not None:
+                    unresolved.add(artist)
+            to_try = next_to_try
+
+    # same order as the artists were first listed
+    return {artist: artists_found[artist] for artist in album_urls if artist in artists_found}
+
+
+
+# helpers for earliest_album_date_allmusic, below
+
+# param: artist - an artist name
+# returns: the url of the best match for the artist on allmusic.com, or None if there were no matches
+# raises: fetching.FetchError if the search could not be fetched
+def search_artist_allmusic(artist, session = None):
+    # search for the artist...
+    artist_formatted = quote(artist)
+    page = fe.get(ALLMUSIC_URL + '/search/artists/' + artist_formatted, session)
+    tree = html.fromstring(page.content)
+
+    # i'm assuming the first result returned by the search is the best match
+    # the url of the artist page for the best match for the search term
+    url_match_list = tree.xpath('//div[@class="info"]/div[@class="name"]/a/@href')
+
+    return url_match_list[0] if len(url_match_list) > 0 else None
+
+# param: artist_url - the url of an artist page on allmusic.com
+# returns: the earliest year in that artist's discography, or -1 if it has a release without a year or has no releases
+# raises: fetching.FetchError if the discography could not be fetched
+def earliest_year_allmusic(artist_url, session = None):
+    # go to that page's discography
+    page = fe.get(artist_url + '/discography', session)
+    tree = html.fromstring(page.content)
+
+    earliest_release = None
+    for album_html in tree.xpath('//tbody/tr'):
+        try:
+            year = int(album_html.xpath('td[@class="year"]/text()')[0].strip())
+        except ValueError:
+            # need to remove the artist entirely, since that year could be before 2000! :(
+            # to do so, simply interpret the year as one before 2000
+            return -1
+        if earliest_release is None or year < earliest_release:
+            earliest_release = year
+
+    return earliest_release if earliest_release is not None else -1
+
+# earliest year of an artist whose allmusic.com pages could not be fetched, so who can't be checked (unlike None, for not found)
+UNKNOWN_YEAR = 'unknown'
+
+# param: artist - an artist name
+# returns: the earliest year in the artist's discography on allmusic.com, like iter_earliest_album_dates does (None if not found,
+#          UNKNOWN_YEAR if a page could not be fetched)
+def earliest_year_allmusic_artist(artist, session = None):
+    try:
+        best_match_url = search_artist_allmusic(artist, session)
+        if best_match_url is None:
+            return None
+        return earliest_year_allmusic(best_match_url, session)
+    except fe.FetchError as e:
+        print(e)
+        return UNKNOWN_YEAR
+
+# for each artist, get the earliest album year from allmusic.com, using up to max_workers threads
+# the search and discography requests of different artists overlap: as soon as an artist's search finishes, their discography is fetched,
+# while the searches for the next artists are still going. only about 2 * max_workers artists are in progress at a time
+# params: artists - artist names
+#         max_workers - the maximum number of requests in flight at any time
+# yields: (artist, earliest year) tuples, in the order they finish. earliest year is None if the artist wasn't found on allmusic.com,
+#         -1 if the artist has a release without a year (see earliest_year_allmusic), and UNKNOWN_YEAR if a page could not be fetched
+def iter_earliest_album_dates(artists, max_workers = 8, session = None):
+    artists = iter(artists)
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        # keys = futures, values = the artist
+        searches = {}
+        discographies = {}
+
+        def start_searches():
+            for artist in artists:
+                searches[pool.submit(search_artist_allmusic, artist, session)] = artist
+                if len(searches) + len(discographies) >= 2 * max_workers:
+                    break
+
+        start_searches()
+        while len(searches) + len(discographies) > 0:
+            done, _ = wait(list(searches) + list(discographies), return_when = FIRST_COMPLETED)
+            for future in done:
+                if future in searches:
+                    artist = searches.pop(future)
+                    try:
+                        best_match_url = future.result()
+                    except fe.FetchError as e:
+                        print(e)
+                        yield artist, UNKNOWN_YEAR
+                        continue
+                    if best_match_url is None:
+                        yield artist, None
+                    else:
+                        discographies[pool.submit(earliest_year_allmusic, best_match_url, session)] = artist
+                else:
+                    artist = discographies.pop(future)
+                    try:
+                        yield artist, future.result()
+                    except fe.FetchError as e:
+                        print(e)
+                        yield artist, UNKNOWN_YEAR
+            start_searches()
 
 # for each artist in artists, get the earliest album date the artist released, according to allmusic.com
 # as metacritic.com only includes albums released after mid-1999
 # param: artists - the set of artist names to check
+#        session - requests session to use, defaults to the shared session from fetching.py
+#        max_workers - number of requests to make at once. if more than 1, artists are checked with iter_earliest_album_dates
 # the function will remove artists will releases before 2000 from the set
+# artists whose allmusic.com pages could not be fetched are removed too, since they can't be checked, but they are not known to have
+# early releases: they are returned (a dictionary like artists), so they can be checked again later instead of being excluded
 
-def earliest_album_date_allmusic(artists):
+def earliest_album_date_allmusic(artists, session = None, max_workers = 1):
     artists_to_remove = set()
+    unchecked = {}
+
+    if max_workers > 1:
+        earliest_dates = iter_earliest_album_dates(list(artists.keys()), max_workers, session)
+    else:
+        earliest_dates = ((artist, earliest_year_allmusic_artist(artist, session)) for artist in artists.keys())
 
     # for io progress tracking
     num_artists = len(artists)
     cur_artist = 1
     print("earliest album date check from allmusic...")
-    for artist in artists.keys():
+    for artist, earliest_release in earliest_dates:
         # io progress tracking
         print(cur_artist, " out of ", num_artists)
         cur_artist += 1
         # end io progess tracking
 
-        # search for the artist...
-        artist_formatted = quote(artist)
-        page = requests.get('http://www.allmusic.com/search/artists/' + artist_formatted, headers={'User-Agent': 'Mozilla/5.0'})
-        tree = html.fromstring(page.content)
-
-        #print(artist)
-
-        # i'm assuming the first result returned by the search is the best match
-        # the url of the artist page for the best match for the search term
-
-        url_match_list = tree.xpath('//div[@class="info"]/div[@class="name"]/a/@href')
-
-        if len(url_match_list) > 0:
-            best_match_url = url_match_list[0]
-
-            # go to that page's discography
-            page = requests.get(best_match_url + '/discography', headers={'User-Agent': 'Mozilla/5.0'})
-            tree = html.fromstring(page.content)
-
-            albums_html = tree.xpath('//tbody/tr')
-            years = []
-
-            for album_html in albums_html:
-                #print(album_html.xpath('td[@class="year"]/text()')[0].strip())
-                try:
-                    year = int(album_html.xpath('td[@class="year"]/text()')[0].strip())
-                    years.append(year)
-                except ValueError:
-                    # need to remove the artist entirely, since that year could be before 2000! :(
-                    # to do so, simply interpret the year as one before 2000
-                    years.append(-1)
-
-            years.sort()
-            earliest_release = years[0] if len(years) > 0 else -1
-            # if that is earlier than 2000, then must remove this artist from the set
-            if earliest_release < 2000:
-                artists_to_remove.add(artist)
-        else: # no matches, so couldn't find the artist in allmusic.com, so must remove
+        if earliest_release == UNKNOWN_YEAR:
+            unchecked[artist] = artists[artist]
+            artists_to_remove.add(artist)
+        # no matches, so couldn't find the artist in allmusic.com, so must remove
+        # or if that is earlier than 2000, then must remove this artist from the set
+        elif earliest_release is None or earliest_release < 2000:
             artists_to_remove.add(artist)
 
     for artist in artists_to_remove:
         del artists[artist]
+    if len(unchecked) > 0:
+        print(len(unchecked), " artists could not be checked on allmusic")
+    return unchecked
+
 
 
 
 # param: a single artist name
+#        session - requests session to use, defaults to the shared session from fetching.py
 # returns: the url of that artist's page on metacritic
 
-def get_artist_url_metacritic(artist):
+def get_artist_url_metacritic(artist, session = None):
     print(artist)
     artist = quote(artist)
-    page = requests.get('http://www.metacritic.com/search/person/' + artist + '/results', headers={'User-Agent': 'Mozilla/5.0'})
+    page = fe.get(METACRITIC_URL + '/search/person/' + artist + '/results', session)
     try:
         tree = html.fromstring(page.content)
 
@@ -130,7 +614,7 @@ def get_artist_url_metacritic(artist):
         match_urls = tree.xpath('//ul[contains(@class, "search_results")]/li[contains(@class, "first_result")]//h3[contains(@class, "product_title")]/a/@href')
 
         if len(match_urls) > 0:
-            return 'http://www.metacritic.com' + match_urls[0]
+            return METACRITIC_URL + match_urls[0]
             # note: for one artist, not sure why, the search by the artist name did not bring up a page...
         else:
             return None
@@ -139,31 +623,47 @@ def get_artist_url_metacritic(artist):
 
 
 
-# param: the url for a given artist's page on metacritic.com
-# returns: a list of lists, each sub-list containing data on a single release of that artist
-
-def get_albums_from_artist_page(artist_url):
-    page = requests.get('http://www.metacritic.com' + artist_url + '?filter-options=music&sort_options=date&num_items=100', headers={'User-Agent': 'Mozilla/5.0'})
-    try:
-        tree = html.fromstring(page.content)
-        it_over = tree.xpath("//table[contains(@class, 'credits')]/tbody/tr")
-
-        all_albums = []
+# xpaths for the release table on an artist page, compiled once instead of on every call
+# each field xpath is relative to a row, in the order: critic score, album name, date, role, user score
+# the album name is all the text of its link (as the browse page titles from product_title_releases are), not only the text before any
+# markup in it, so update_artists_albums can match the two
+ALBUM_ROWS_XPATH = etree.XPath("//table[contains(@class, 'credits')]/tbody/tr")
+ALBUM_LINKS_XPATH = etree.XPath("td/a")
+ALBUM_FIELD_XPATHS = [etree.XPath("td/span[contains(@class, 'metascore_w')]/text()"),
+                      lambda row : [ELEMENT_STRING(a) for a in ALBUM_LINKS_XPATH(row)],
+                      etree.XPath("td[contains(@class, 'year')]/text()"),
+                      etree.XPath("td[contains(@class, 'role')]/text()"),
+                      etree.XPath("td[contains(@class, 'score')]/span[contains(@class, 'textscore')]/text()")]
 
-        for album_html in it_over:
-            l = []
-            l.append(album_html.xpath("td/span[contains(@class, 'metascore_w')]/text()"))
-            l.append(album_html.xpath("td/a/text()"))
-            l.append(album_html.xpath("td[contains(@class, 'year')]/text()"))
-            l.append(album_html.xpath("td[contains(@class, 'role')]/text()"))
-            l.append(album_html.xpath("td[contains(@class, 'score')]/span[contains(@class, 'textscore')]/text()"))
+# param: album_html - a single row of the release table on an artist page
+# returns: the list of that release's (stripped) fields
+def parse_album_row(album_html):
+    return [field_xpath(album_html)[0].strip() for field_xpath in ALBUM_FIELD_XPATHS]
 
-            for i in range(len(l)):
-                l[i] = l[i][0].strip()
+# param: tree - a parsed artist page
+# returns: a list of lists, each sub-list containing data on a single release of that artist
+def parse_albums_from_tree(tree):
+    return [parse_album_row(album_html) for album_html in ALBUM_ROWS_XPATH(tree)]
 
-            all_albums.append(l)
+# param: the url for a given artist's page on metacritic.com
+#        session - requests session to use, defaults to the shared session from fetching.py
+#        streaming - parse the page as it downloads, keeping only the release table rows in memory (see stream_extract)
+# returns: a list of lists, each sub-list containing data on a single release of that artist, or None if the page could not be parsed
+# raises: fetching.FetchError if the page could not be downloaded (so the caller can try again later)
+
+def get_albums_from_artist_page(artist_url, session = None, streaming = False):
+    url = METACRITIC_URL + artist_url + '?filter-options=music&sort_options=date&num_items=100'
+    if streaming:
+        chunks = fe.iter_content(url, session)
+        try:
+            return stream_extract(chunks, ARTIST_PAGE_EXTRACTORS)['albums']
+        except (etree.LxmlError, IndexError):
+            return None
 
-        return all_albums
+    page = fe.get(url, session)
+    try:
+        tree = html.fromstring(page.content)
+        return parse_albums_from_tree(tree)
 
-    except: # change this to specify the LXML XMLSyntaxError...
+    except (etree.LxmlError, IndexError): # empty or broken page, or a release missing one of the fields
         return None